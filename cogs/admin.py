@@ -2,12 +2,15 @@ import discord
 import youtube_dl
 import asyncio
 import shutil
+import datetime
 from discord.ext import commands
-from __main__ import settings, botdata, httpgetter
+from __main__ import settings, botdata, httpgetter, loggingdb_session
 from cogs.utils.helpers import *
 from cogs.utils.botdata import GuildInfo
-from cogs.utils.clip import GttsLang
+from cogs.utils.clip import GttsLang, TtsEngine
 from cogs.utils import checks
+from cogs.utils import loggingdb
+from cogs.utils.perf import percentile
 from .mangocog import *
 
 class Admin(MangoCog):
@@ -109,6 +112,8 @@ class Admin(MangoCog):
 			embed.add_field(name="Value", value=f"<@&{value}>" if value else "None")
 		elif var["type"] == "GttsLang":
 			embed.add_field(name="Value", value=GttsLang(value).pretty)
+		elif var["type"] == "TtsEngine":
+			embed.add_field(name="Value", value=value)
 		else:
 			raise ValueError("I don't know how to parse this type")
 		embed.add_field(name="Example", value=f"`?config {var['key']} {var['example']}`")
@@ -143,6 +148,12 @@ class Admin(MangoCog):
 				raise UserError("Invalid input. See https://github.com/mdiller/MangoByte/blob/master/resource/json/gtts_languages.json for valid langs")
 			else:
 				return lang.lang
+		elif var["type"] == "TtsEngine":
+			engines = TtsEngine.engines_dict()
+			if value.lower() not in engines:
+				raise UserError(f"Invalid input. The tts engines installed here are: {', '.join(f'`{name}`' for name in engines)}")
+			else:
+				return value.lower()
 		else:
 			raise ValueError("I don't know how to parse this type")
 		embed.add_field(name="Example", value=f"`?config {var['key']} {var['example']}`")
@@ -169,6 +180,8 @@ class Admin(MangoCog):
 		else: # We are setting a value
 			value = await self.config_set_parse(ctx, var, value)
 			botdata.guildinfo(ctx.guild)[var["key"]] = value
+			if var["key"] in [ "ttslang", "ttsengine", "intros", "outros" ]:
+				await self.bot.get_cog("Audio").queue_guild_presynthesis(ctx.guild)
 			await ctx.message.add_reaction("✅")
 
 	@checks.is_owner()
@@ -340,7 +353,63 @@ class Admin(MangoCog):
 		if filename is None:
 			raise UserError("Couldn't find a file at that uri")
 
-		await ctx.send(file=discord.File(filename))
+		if filename.endswith(".gz"): # send it the way it was downloaded, not the compressed copy we keep
+			data = await httpgetter.cache.get(uri, "bytes")
+			await ctx.send(file=discord.File(data, filename=os.path.basename(filename)[:-3]))
+		else:
+			await ctx.send(file=discord.File(filename))
+
+	@checks.is_owner()
+	@commands.command(hidden=True)
+	async def cachestats(self, ctx):
+		"""Shows how much the cache is storing, and how much deduplication and compression are saving"""
+		stats = httpgetter.cache.stats()
+		embed = discord.Embed()
+		embed.add_field(name="Entries", value=f"{stats['entries']:,}")
+		embed.add_field(name="Unique Files", value=f"{stats['blobs']:,}")
+		embed.add_field(name="Disk Usage", value=f"{stats['size'] / 1000000:,.1f} MB")
+		embed.add_field(name="Dedup Savings", value=f"{stats['dedup_savings'] / 1000000:,.1f} MB")
+		embed.add_field(name="Compression Savings", value=f"{stats['compression_savings'] / 1000000:,.1f} MB")
+		embed.add_field(name="Memory Usage", value=f"{stats['memory_size'] / 1000000:,.1f} MB")
+		await ctx.send(embed=embed)
+
+	@checks.is_owner()
+	@commands.command(hidden=True)
+	async def httpstats(self, ctx):
+		"""Shows the circuit breaker and rate limiting stats for the hosts we make http requests to"""
+		embed = discord.Embed()
+		for host, stats in httpgetter.stats().items():
+			embed.add_field(name=host, value="\n".join(f"{key}: {value}" for key, value in stats.items()))
+		await ctx.send(embed=embed)
+
+	@checks.is_owner()
+	@commands.command(hidden=True)
+	async def perfstats(self, ctx, days : int=7):
+		"""Shows how long the most used commands have been taking over the last few days
+
+		Times are in milliseconds. http and render are the average time spent on http requests and drawing images"""
+		since = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+		Message = loggingdb.Message
+		query = loggingdb_session.query(Message.command, Message.duration, Message.error, Message.http_time, Message.render_time).filter(Message.timestamp > since, Message.duration != None)
+		stats = {}
+		for command, duration, error, http_time, render_time in query:
+			stat = stats.setdefault(command, { "durations": [], "errors": 0, "http": 0, "render": 0 })
+			stat["durations"].append(duration * 1000)
+			stat["errors"] += 1 if error else 0
+			stat["http"] += (http_time or 0) * 1000
+			stat["render"] += (render_time or 0) * 1000
+		if not stats:
+			raise UserError(f"No commands have been timed in the last {days} days")
+
+		lines = [ f"{'command':<14}{'count':>6}{'errors':>7}{'p50':>7}{'p95':>7}{'p99':>7}{'http':>7}{'render':>7}" ]
+		for command, stat in sorted(stats.items(), key=lambda item: len(item[1]["durations"]), reverse=True)[:15]:
+			count = len(stat["durations"])
+			lines.append(
+				f"{command:<14}{count:>6}{stat['errors']:>7}"
+				f"{percentile(stat['durations'], 50):>7.0f}{percentile(stat['durations'], 95):>7.0f}{percentile(stat['durations'], 99):>7.0f}"
+				f"{stat['http'] / count:>7.0f}{stat['render'] / count:>7.0f}")
+		lines = "\n".join(lines)
+		await ctx.send(f"Command times for the last {days} days:\n```\n{lines}\n```")
 
 
 def setup(bot):
@@ -29,6 +29,11 @@ class AudioPlayerNotFoundError(UserError):
 	def __init__(self, message):
 		self.message = message
 
+# for a task that nobody is going to await now, stops it, or if it already failed, marks the error as seen
+def abandon_task(task):
+	if not task.cancel() and not task.cancelled():
+		task.exception()
+
 def remove_if_temp(mp3name):
 	if os.path.isfile(mp3name):
 		if os.path.dirname(mp3name) == settings.resource("temp"):
@@ -118,6 +123,10 @@ class Audio(MangoCog):
 		MangoCog.__init__(self, bot)
 		self.audioplayers = []
 		self.local_clipinfo = self.init_local_clipinfo()
+		self.presynthesis_queue = asyncio.Queue()
+		self.presynthesis_queued = set()
+		if settings.tts_presynthesis:
+			self.bot.loop.create_task(self.presynthesis_worker())
 
 	def init_local_clipinfo(self):
 		infofile = settings.resource("clips/clipinfo.json")
@@ -417,6 +426,8 @@ class Audio(MangoCog):
 			return
 
 		botdata.userinfo(user.id).intro = clip.clipid
+		if ctx.guild and ctx.guild.get_member(user.id):
+			await self.queue_presynthesis(ctx.guild.get_member(user.id)) # the intro tts depends on the intro clip
 		await ctx.send(f"Yer intro is now `{clip.clipid}`")
 
 
@@ -488,6 +499,8 @@ class Audio(MangoCog):
 			introtts = " "
 
 		botdata.userinfo(user.id).introtts = introtts
+		if ctx.guild:
+			await self.queue_presynthesis(ctx.author)
 		await ctx.send(f"Yer intro tts is now `{introtts}`")
 
 	@commands.command()
@@ -519,6 +532,8 @@ class Audio(MangoCog):
 			outrotts = " "
 
 		botdata.userinfo(user.id).outrotts = outrotts
+		if ctx.guild:
+			await self.queue_presynthesis(ctx.author)
 		await ctx.send(f"Yer intro tts is now `{outrotts}`")
 
 
@@ -647,6 +662,62 @@ class Audio(MangoCog):
 			name = re.sub("{}([A-Za-z])".format(num), r"{}\1".format(letternumbers[num]), name)
 		return name
 
+	async def get_intro_text(self, member):
+		userinfo = botdata.userinfo(member.id)
+		introtts = userinfo.introtts
+
+		# Special case for default
+		if userinfo.intro == "local:helloits" and introtts == "it's":
+			introtts = ""
+
+		return introtts + " " + await self.fix_name(member.name)
+
+	async def get_outro_text(self, member):
+		return (await self.fix_name(member.name)) + " " + botdata.userinfo(member.id).outrotts
+
+	# queues up making the member's intro and outro tts ahead of time, so they can play right away
+	# only done for members in the voice channel we're in, as they're the ones whose outro could be played next
+	# the clips are cached by their text, ttslang, and ttsengine, so if any of those change, a new one gets made
+	async def queue_presynthesis(self, member):
+		if not settings.tts_presynthesis or member.bot:
+			return
+		key = (member.guild.id, member.id)
+		if key in self.presynthesis_queued or botdata.userinfo(member.id).json_data is None:
+			return # already queued or not registered
+		audioplayer = await self.audioplayer(member.guild, error_on_none=False)
+		if audioplayer is None or audioplayer.voice is None or member.voice is None or member.voice.channel is None:
+			return
+		if member.voice.channel.id != audioplayer.voice.channel.id:
+			return
+		self.presynthesis_queued.add(key)
+		self.presynthesis_queue.put_nowait(member)
+
+	# queues presynthesis for the members in the voice channel we're in on this guild
+	async def queue_guild_presynthesis(self, guild):
+		audioplayer = await self.audioplayer(guild, error_on_none=False)
+		if not settings.tts_presynthesis or audioplayer is None or audioplayer.voice is None:
+			return
+		for member in audioplayer.voice.channel.members:
+			await self.queue_presynthesis(member)
+
+	# makes the queued clips one at a time, so we dont flood the tts engine
+	async def presynthesis_worker(self):
+		while True:
+			member = await self.presynthesis_queue.get()
+			self.presynthesis_queued.discard((member.guild.id, member.id))
+			try:
+				guildinfo = botdata.guildinfo(member.guild)
+				if guildinfo.intros:
+					await get_tts_file(await self.get_intro_text(member), guildinfo.ttslang, guildinfo.ttsengine)
+				if guildinfo.outros:
+					await get_tts_file(await self.get_outro_text(member), guildinfo.ttslang, guildinfo.ttsengine)
+			except Exception as e:
+				print(f"presynthesis failed for {member.name}: {e}")
+
+	async def on_member_update(self, before, after):
+		if before.name != after.name:
+			await self.queue_presynthesis(after)
+
 	#function called when this event occurs
 	async def on_voice_state_update(self, member, before, after):
 		if member.bot and member.id != self.bot.user.id:
@@ -656,39 +727,46 @@ class Audio(MangoCog):
 		if before and before.channel and botdata.guildinfo(before.channel.guild).outros:
 			beforeplayer = await self.audioplayer(before.channel, error_on_none=False)
 			if beforeplayer is not None and beforeplayer.voice is not None and beforeplayer.voice.channel.id == before.channel.id:
-				userinfo = botdata.userinfo(member.id)
+				guildinfo = botdata.guildinfo(before.channel.guild)
+				outroclip = botdata.userinfo(member.id).outro
 
-				outroclip = userinfo.outro
-				outrotts = userinfo.outrotts
-
-				text = (await self.fix_name(member.name)) + " " + outrotts
+				text = await self.get_outro_text(member)
 				print(text)
 
-				await asyncio.sleep(0.5)
-				await self.play_clip(outroclip, before.channel)
+				# start making the tts now, so its ready by the time the outro clip is done
+				tts_task = asyncio.ensure_future(get_tts_file(text, guildinfo.ttslang, guildinfo.ttsengine))
+				try:
+					await asyncio.sleep(0.5)
+					await self.play_clip(outroclip, before.channel)
+				except:
+					abandon_task(tts_task)
+					raise
+				await tts_task
 				await self.play_clip("tts:" + text, before.channel)
 		if after and after.channel and botdata.guildinfo(after.channel.guild).intros:
 			afterplayer = await self.audioplayer(after.channel, error_on_none=False)
 			if afterplayer is not None and afterplayer.voice is not None and afterplayer.voice.channel.id == after.channel.id:
 				if member.id == self.bot.user.id:
 					botdata.guildinfo(after.channel.guild.id).voicechannel = after.channel.id
+					await self.queue_guild_presynthesis(after.channel.guild)
 
-				userinfo = botdata.userinfo(member.id)
+				guildinfo = botdata.guildinfo(after.channel.guild)
+				introclip = botdata.userinfo(member.id).intro
 
-				introclip = userinfo.intro
-				introtts = userinfo.introtts
-
-				# Special case for default
-				if userinfo.intro == "local:helloits" and introtts == "it's":
-					introtts = ""
-
-				text = introtts + " " + await self.fix_name(member.name)
+				text = await self.get_intro_text(member)
 				print(text + " joined the channel")
 
-				await asyncio.sleep(3)
-				await self.play_clip(introclip, after.channel)
+				# start making the tts now, so its ready by the time the intro clip is done
+				tts_task = asyncio.ensure_future(get_tts_file(text, guildinfo.ttslang, guildinfo.ttsengine))
+				try:
+					await asyncio.sleep(3)
+					await self.play_clip(introclip, after.channel)
+				except:
+					abandon_task(tts_task)
+					raise
+				await tts_task
 				await self.play_clip("tts:" + text, after.channel)
-
+				await self.queue_presynthesis(member) # for when they leave
 
 def setup(bot):
 	bot.add_cog(Audio(bot))
\ No newline at end of file
@@ -83,6 +83,13 @@ class Dotabase(MangoCog):
 		self.build_aliases()
 		self.vpkurl = "http://dotabase.dillerm.io/dota-vpk"
 		drawdota.init_dota_info(self.get_hero_infos(), self.get_item_infos())
+		self.prewarmed = False
+
+	async def on_ready(self):
+		# on_ready gets called again on reconnects, so only do this the first time
+		if settings.cache_prewarm and not self.prewarmed:
+			self.prewarmed = True
+			self.bot.loop.create_task(drawdota.prewarm_images(settings.cache_prewarm_concurrency))
 
 	def build_aliases(self):
 		for hero in session.query(Hero):
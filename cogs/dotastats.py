@@ -43,13 +43,13 @@ opendota_html_errors = {
 	"default": "OpenDota said we did things wrong 😢. status code: {}"
 }
 
-async def opendota_query(querystring, cache=False):
-	return await httpgetter.get(f"https://api.opendota.com/api{querystring}", cache=cache, errors=opendota_html_errors)
+async def opendota_query(querystring, cache=False, stale_while_revalidate=False):
+	return await httpgetter.get(f"https://api.opendota.com/api{querystring}", cache=cache, errors=opendota_html_errors, stale_while_revalidate=stale_while_revalidate)
 
 # rate_limit = false if this is the only query we're sending
 async def get_match(match_id):
 	url = f"https://api.opendota.com/api/matches/{match_id}"
-	cached_data = httpgetter.cache.get(url, "json")
+	cached_data = await httpgetter.cache.get(url, "json")
 	
 	if cached_data:
 		if cached_data["version"]:
@@ -69,7 +69,7 @@ async def get_match(match_id):
 # rate_limit = false if this is the only query we're sending
 async def get_stratz_match(match_id):
 	url = f"https://api.stratz.com/api/v1/match/{match_id}"
-	cached_data = httpgetter.cache.get(url, "json")
+	cached_data = await httpgetter.cache.get(url, "json")
 	
 	if cached_data:
 		if is_stratz_parsed(cached_data):
@@ -82,7 +82,7 @@ async def get_stratz_match(match_id):
 	})
 
 async def get_lastmatch_id(steamid):
-	matches = await opendota_query(f"/players/{steamid}/recentmatches")
+	matches = await opendota_query(f"/players/{steamid}/recentmatches", cache=True)
 	if matches:
 		return matches[0]["match_id"]
 	else:
@@ -157,8 +157,8 @@ async def get_check_steamid(player, ctx, mention=False, no_error=False):
 		if player > 76561197960265728:
 			player -= 76561197960265728
 
-		# Don't have to rate limit here because this will be first query ran
-		player_info = await opendota_query(f"/players/{player}")
+		# Answered from the cache if we've seen this player before, and refreshed in the background
+		player_info = await opendota_query(f"/players/{player}", cache=True, stale_while_revalidate=True)
 
 		if player_info.get("profile") is None:
 			raise UserError("Either this person doesn't play dota, or they haven't enabled public match data")
@@ -403,7 +403,7 @@ class DotaStats(MangoCog):
 		if steam_id > 76561197960265728:
 			steam_id -= 76561197960265728
 
-		player = await opendota_query(f"/players/{steam_id}")
+		player = await opendota_query(f"/players/{steam_id}", cache=True)
 
 		if player.get("profile") is None:
 			raise UserError("Either thats a bad id, you don't play dota, or ya haven't enabled public match data")
@@ -561,7 +561,7 @@ class DotaStats(MangoCog):
 
 		await ctx.channel.trigger_typing()
 
-		matches = await opendota_query(f"/players/{steam32}/recentmatches")
+		matches = await opendota_query(f"/players/{steam32}/recentmatches", cache=True)
 
 		if matchcount < 1:
 			raise UserError("Gotta have a matchcount of 1 or more")
@@ -592,7 +592,7 @@ class DotaStats(MangoCog):
 
 		await ctx.channel.trigger_typing()
 
-		playerinfo = await opendota_query(f"/players/{steam32}")
+		playerinfo = await opendota_query(f"/players/{steam32}", cache=True, stale_while_revalidate=True)
 		matches = await opendota_query(f"/players/{steam32}/matches")
 
 		gamesplayed = len(matches)
@@ -713,7 +713,7 @@ class DotaStats(MangoCog):
 		with ctx.channel.typing():
 			await thinker.think(ctx.message)
 
-			playerinfo = await opendota_query(f"/players/{steam32}")
+			playerinfo = await opendota_query(f"/players/{steam32}", cache=True, stale_while_revalidate=True)
 			matches_info = await opendota_query(f"/players/{steam32}/matches")
 			player_matches = []
 			matches = []
@@ -944,7 +944,7 @@ class DotaStats(MangoCog):
 
 		await ctx.channel.trigger_typing()
 		await thinker.think(ctx.message)
-		playerinfo = await opendota_query(f"/players/{steam32}")
+		playerinfo = await opendota_query(f"/players/{steam32}", cache=True, stale_while_revalidate=True)
 		matches = await opendota_query(f"/players/{steam32}/matches{queryargs}")
 		await thinker.stop_thinking(ctx.message)
 
@@ -1035,8 +1035,8 @@ class DotaStats(MangoCog):
 		if author_id == friend_id:
 			raise UserError("🙄 ...Try giving me someone other than yourself...")
 
-		author_info = await opendota_query(f"/players/{author_id}")
-		friend_info = await opendota_query(f"/players/{friend_id}")
+		author_info = await opendota_query(f"/players/{author_id}", cache=True, stale_while_revalidate=True)
+		friend_info = await opendota_query(f"/players/{friend_id}", cache=True, stale_while_revalidate=True)
 
 		def on_same_team(match):
 			heroes = match["heroes"]
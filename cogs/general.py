@@ -135,23 +135,25 @@ class General(MangoCog):
 		embed.set_author(name=self.bot.user.name, icon_url=self.bot.user.avatar_url)
 
 		embed.add_field(name="Servers/Guilds", value="{:,}".format(len(self.bot.guilds)))
-		embed.add_field(name="Registered Users", value="{:,}".format(len(list(filter(lambda user: user.steam32, botdata.userinfo_list())))))
+		embed.add_field(name="Registered Users", value="{:,}".format(botdata.count("userinfo", "steam32")))
 
-		commands = loggingdb_session.query(loggingdb.Message).filter(loggingdb.Message.command != None)
-		commands_weekly = commands.filter(loggingdb.Message.timestamp > datetime.datetime.utcnow() - datetime.timedelta(weeks=1))
-		embed.add_field(name="Commands", value=f"{commands.count():,}")
-		embed.add_field(name="Commands (This Week)", value=f"{commands_weekly.count():,}")
+		week_start = datetime.datetime.utcnow().date() - datetime.timedelta(days=6)
+		commands_total = loggingdb_session.query(func.sum(loggingdb.CommandTotal.count)).scalar() or 0
+		commands_weekly = loggingdb_session.query(func.sum(loggingdb.CommandCount.count)).filter(loggingdb.CommandCount.date >= week_start).scalar() or 0
+		embed.add_field(name="Commands", value=f"{commands_total:,}")
+		embed.add_field(name="Commands (This Week)", value=f"{commands_weekly:,}")
 
 
-		top_commands = loggingdb_session.query(loggingdb.Message.command, func.count(loggingdb.Message.command)).filter(loggingdb.Message.command != None).group_by(loggingdb.Message.command).order_by(func.count(loggingdb.Message.command).desc())
-		if top_commands.count() >= 3:
+		top_commands = loggingdb_session.query(loggingdb.CommandTotal.command).order_by(loggingdb.CommandTotal.count.desc()).limit(3).all()
+		if len(top_commands) >= 3:
 			embed.add_field(name="Top Commands", value=(
 				f"`?{top_commands[0][0]}`\n"
 				f"`?{top_commands[1][0]}`\n"
 				f"`?{top_commands[2][0]}`\n"))
 
-		top_commands_weekly = top_commands.filter(loggingdb.Message.timestamp > datetime.datetime.utcnow() - datetime.timedelta(weeks=1))
-		if top_commands_weekly.count() >= 3:
+		weekly_count = func.sum(loggingdb.CommandCount.count)
+		top_commands_weekly = loggingdb_session.query(loggingdb.CommandCount.command, weekly_count).filter(loggingdb.CommandCount.date >= week_start).group_by(loggingdb.CommandCount.command).order_by(weekly_count.desc()).limit(3).all()
+		if len(top_commands_weekly) >= 3:
 			embed.add_field(name="Top Commands (This Week)", value=(
 				f"`?{top_commands_weekly[0][0]}`\n"
 				f"`?{top_commands_weekly[1][0]}`\n"
@@ -435,12 +437,6 @@ class General(MangoCog):
 				await message.add_reaction(random.choice(check["reaction"]))
 				break
 
-	async def on_command(self, ctx):
-		msg = loggingdb.convert_message(ctx)
-		loggingdb_session.add(msg)
-		loggingdb_session.commit()
-		print(msg)
-
 
 
 def setup(bot):
@@ -1,58 +1,72 @@
 from .helpers import *
+from .botdatadb import SqliteBackend
 import os
+import atexit
 import discord
 from collections import OrderedDict
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor
+
+save_delay = 5 # seconds to wait after a change before writing botdata.json, so bursts of changes get written once
+
+# the types that config variables are stored as, for the ones that can't be stored directly
+stored_types = {
+	discord.TextChannel: int,
+	discord.Role: int,
+	"GttsLang": str,
+	"TtsEngine": str
+}
 
 class ListVar:
 	def __init__(self, t):
 		self.type = t
 
+# a view of one item in botdata, which reads from and writes to the backend
+# the defaults are shared by the whole class, so creating one of these is cheap
 class BotDataItem:
-	def __init__(self, botdata, list_key, primary_keys, defaults):
-		self.__dict__.update({
-			"_botdata": botdata,
-			"_list_key": list_key,
-			"_primary_keys": primary_keys,
-			"defaults": defaults
-		})
+	__slots__ = ("_botdata", "_key")
+
+	def __init__(self, botdata, *key):
+		object.__setattr__(self, "_botdata", botdata)
+		object.__setattr__(self, "_key", key)
 
 	@property
 	def json_data(self):
-		for item in self._botdata.json_data[self._list_key]:
-			if all(item.get(key) == self._primary_keys[key] for key in self._primary_keys):
-				return item
-		return None
+		return self._botdata.backend.get(self.list_key, self._key)
+
+	# whether the value is the same as the default, so it doesnt need to be stored
+	def is_default(self, key, val):
+		default = self.defaults[key]
+		if isinstance(default, tuple) and isinstance(val, list):
+			return tuple(val) == default
+		return val == default
 
 	def __getattr__(self, key):
-		if key in self._primary_keys:
-			return self._primary_keys[key]
+		if key in self.primary_key_types:
+			return self._key[list(self.primary_key_types).index(key)]
 		if key not in self.defaults:
-			raise ValueError(f"Tried to get invalid '{key}' in {self._list_key}")
-		if self.json_data:
-			return self.json_data.get(key, self.defaults.get(key))
-		return self.defaults.get(key)
+			raise ValueError(f"Tried to get invalid '{key}' in {self.list_key}")
+		json_data = self.json_data
+		if json_data:
+			return json_data.get(key, self.defaults[key])
+		return self.defaults[key]
 
 	def __setattr__(self, key, val):
-		if key in self._primary_keys:
+		if key in self.primary_key_types:
 			raise ValueError("You can't set a primary key")
 		if key not in self.defaults:
-			raise ValueError(f"Tried to set invalid '{key}' in {self._list_key}")
+			raise ValueError(f"Tried to set invalid '{key}' in {self.list_key}")
 
+		json_data = self.json_data
 		# recreate to order correctly
-		newdict = OrderedDict(self._primary_keys)
+		newdict = OrderedDict(zip(self.primary_key_types, self._key))
 		for k in self.defaults:
 			if k == key:
-				if val != self.defaults[key]:
+				if not self.is_default(key, val):
 					newdict[k] = val
-			elif self.json_data and k in self.json_data:
-				newdict[k] = self.json_data[k]
-		# now save to json
-		if self.json_data:
-			index = self._botdata.json_data[self._list_key].index(self.json_data)
-			self._botdata.json_data[self._list_key][index] = newdict
-		else:
-			self._botdata.json_data[self._list_key].append(newdict)
-		self._botdata.save_data()
+			elif json_data and k in json_data:
+				newdict[k] = json_data[k]
+		self._botdata.backend.set(self.list_key, self._key, newdict)
 
 	__getitem__ = __getattr__
 	__setitem__ = __setattr__
@@ -72,25 +86,27 @@ class BotDataItem:
 			self[key] = new_list
 
 class UserInfo(BotDataItem):
-	def __init__(self, botdata, discord):
-		BotDataItem.__init__(self, botdata, "userinfo", { "discord": discord }, OrderedDict([
-			("steam32", None),
-			("intro", "local:helloits"),
-			("outro", "local:farewell"),
-			("introtts", "it's"),
-			("outrotts", "has left!")
-		]))
-	
+	list_key = "userinfo"
+	primary_key_types = OrderedDict([ ("discord", int) ])
+	variable_types = OrderedDict([
+		("steam32", int),
+		("intro", str),
+		("outro", str),
+		("introtts", str),
+		("outrotts", str)
+	])
+	indexed = ("steam32",)
+	__slots__ = ()
+	defaults = MappingProxyType(OrderedDict([
+		("steam32", None),
+		("intro", "local:helloits"),
+		("outro", "local:farewell"),
+		("introtts", "it's"),
+		("outrotts", "has left!")
+	]))
+
 class GuildInfo(BotDataItem):
-	def __init__(self, botdata, guildid):
-		defaults = OrderedDict([ 
-			("voicechannel", None),
-			("invalidcommands", False),
-			("banned_users", [])
-		])
-		for var in self.variables:
-			defaults[var["key"]] = var["default"]
-		BotDataItem.__init__(self, botdata, "guildinfo", { "id": guildid }, defaults)
+	__slots__ = ()
 
 	variables = [
 		{
@@ -134,9 +150,35 @@ class GuildInfo(BotDataItem):
 			"type": "GttsLang",
 			"description": "Sets the language/voice that mangobyte will use to speak using the `?tts` command. To see a list of all of the possible languages, check out [this file](https://github.com/mdiller/MangoByte/blob/master/resource/json/gtts_languages.json) in the github repo",
 			"example": "Russian"
+		},
+		{
+			"key": "ttsengine",
+			"default": "gtts",
+			"type": "TtsEngine",
+			"description": "Sets the engine that mangobyte will use to speak. `gtts` uses google's voices, which sound nicer and know more languages. `pico2wave` and `espeak-ng` run on the bot itself, so they're quicker and don't break when google is having problems. If the engine doesn't work, mangobyte will try one of the others instead",
+			"example": "pico2wave"
 		}
 	]
 
+	list_key = "guildinfo"
+	primary_key_types = OrderedDict([ ("id", int) ])
+	variable_types = OrderedDict([
+		("voicechannel", int),
+		("invalidcommands", bool),
+		("banned_users", ListVar(int))
+	])
+	variable_types.update((var["key"], stored_types.get(var["type"], var["type"])) for var in variables)
+	indexed = ()
+
+	# lists default to tuples, so that the shared defaults can't be modified by accident
+	defaults = OrderedDict([
+		("voicechannel", None),
+		("invalidcommands", False),
+		("banned_users", ())
+	])
+	defaults.update((var["key"], var["default"]) for var in variables)
+	defaults = MappingProxyType(defaults)
+
 	def is_banned(self, user):
 		return user.id in self.banned_users
 
@@ -148,25 +190,119 @@ class GuildInfo(BotDataItem):
 
 
 
-class BotData:
-	def __init__(self):
-		self.path = "botdata.json"
-		self.defaults = OrderedDict([ ("userinfo" , []), ("guildinfo" , []) ])
+# keeps all of botdata in memory, saving it to botdata.json
+class JsonBackend:
+	def __init__(self, path, item_types, write_behind=True):
+		self.path = path
+		self.write_behind = write_behind
+		self.dirty = False
+		self.loop = asyncio.get_event_loop()
+		self.executor = ThreadPoolExecutor(max_workers=1) # one thread so the writes happen in order
+		self.primary_keys = OrderedDict((item_type.list_key, tuple(item_type.primary_key_types)) for item_type in item_types)
+		self.indexed = { item_type.list_key: item_type.indexed for item_type in item_types }
 		if not os.path.exists(self.path):
-			self.json_data = self.defaults
+			self.json_data = OrderedDict((list_key, []) for list_key in self.primary_keys)
 			self.save_data()
 		else:
-			current = read_json(self.path)
-			if current.keys() != self.defaults.keys():
-				for key in self.defaults.keys():
-					if key not in current.keys():
-						current[key] = self.defaults[key]
-						print("Adding " + str(key) + " field to botdata.json")
-				write_json(self.path, current)
 			self.json_data = read_json(self.path)
+			for key in self.primary_keys:
+				if key not in self.json_data:
+					self.json_data[key] = []
+					print("Adding " + str(key) + " field to botdata.json")
+					self.save_data()
+		self.build_index()
+		atexit.register(self.close)
+
+	# builds a dict of the items in each list by their primary keys, so lookups don't have to scan the lists
+	def build_index(self):
+		self.index = {}
+		for list_key, keys in self.primary_keys.items():
+			self.index[list_key] = {}
+			for item in self.json_data[list_key]:
+				self.index[list_key].setdefault(tuple(item.get(key) for key in keys), item)
+		self.secondary = {}
+		for list_key, columns in self.indexed.items():
+			self.secondary[list_key] = { column: {} for column in columns }
+			for key, item in self.index[list_key].items():
+				self.update_secondary(list_key, key, item, True)
+
+	# adds or removes an item from the indexes of its indexed variables, like steam32
+	def update_secondary(self, list_key, key, item, add):
+		for column, index in self.secondary[list_key].items():
+			value = item.get(column)
+			if value is None:
+				continue
+			if add:
+				index.setdefault(value, set()).add(key)
+			else:
+				index[value].discard(key)
+				if not index[value]:
+					del index[value]
+
+	def get(self, list_key, key):
+		return self.index[list_key].get(key)
 
+	def set(self, list_key, key, data):
+		json_data = self.index[list_key].get(key)
+		if json_data is not None:
+			# update in place so the list and the index still point at the same dict
+			self.update_secondary(list_key, key, json_data, False)
+			json_data.clear()
+			json_data.update(data)
+		else:
+			self.json_data[list_key].append(data)
+			self.index[list_key][key] = data
+		self.update_secondary(list_key, key, data, True)
+		self.save_data()
+
+	# gets the primary keys of the items where the indexed variable has the given value
+	def find(self, list_key, column, value):
+		return list(self.secondary[list_key][column].get(value, ()))
+
+	def items(self, list_key):
+		return list(self.json_data[list_key])
+
+	def count(self, list_key, key=None):
+		if key is None:
+			return len(self.json_data[list_key])
+		return sum(1 for item in self.json_data[list_key] if item.get(key) is not None)
+
+	# marks the data as changed, writing it out after save_delay if write_behind is enabled
 	def save_data(self):
-		write_json(self.path, self.json_data)
+		if not self.write_behind:
+			write_json(self.path, self.json_data)
+			return
+		if not self.dirty:
+			self.dirty = True
+			self.loop.call_later(save_delay, self.flush)
+
+	# writes out any changes, doing the file io on the executor
+	def flush(self):
+		if not self.dirty:
+			return
+		self.dirty = False
+		text = json.dumps(self.json_data, indent="\t")
+		self.loop.run_in_executor(self.executor, write_text, self.path, text)
+
+	# finishes any pending writes, called at shutdown
+	def close(self):
+		self.executor.shutdown(wait=True)
+		if self.dirty:
+			self.dirty = False
+			write_json(self.path, self.json_data)
+
+
+class BotData:
+	def __init__(self, backend="json"):
+		self.item_types = [ UserInfo, GuildInfo ]
+		if backend == "json":
+			self.backend = JsonBackend("botdata.json", self.item_types)
+		elif backend == "sqlite":
+			self.backend = SqliteBackend("botdata.db", self.item_types)
+			self.backend.import_json("botdata.json")
+			atexit.register(self.backend.close)
+		else:
+			raise ValueError(f"Unknown botdata backend '{backend}'")
 
 	def userinfo(self, userid):
 		if isinstance(userid, discord.User):
@@ -185,15 +321,34 @@ class BotData:
 		return GuildInfo(self, guildid)
 
 	def guildinfo_list(self):
-		guildinfos = []
-		for data in self.json_data['guildinfo']:
-			guildinfos.append(GuildInfo(self, data['id']))
-		return guildinfos
+		for data in self.backend.items("guildinfo"):
+			yield GuildInfo(self, data["id"])
 
 	def userinfo_list(self):
-		userinfos = []
-		for data in self.json_data['userinfo']:
-			userinfos.append(UserInfo(self, data["discord"]))
-		return userinfos
+		for data in self.backend.items("userinfo"):
+			yield UserInfo(self, data["discord"])
+
+	# counts the items in the list, or only the ones where the given variable has been set
+	def count(self, list_key, key=None):
+		return self.backend.count(list_key, key)
 
+	# gets the discord ids of the users who have linked the given steam account
+	def steam32_discord_ids(self, steam32):
+		return [ key[0] for key in self.backend.find("userinfo", "steam32", steam32) ]
 
+	# gets the members of the guild who have linked a steam account, as a dict of steam32 -> members
+	# if steam32s is given, only those accounts are looked up, like the players in a match
+	def linked_members(self, guild, steam32s=None):
+		linked = {}
+		if steam32s is None:
+			for member in guild.members:
+				data = self.backend.get("userinfo", (member.id,))
+				if data and data.get("steam32") is not None:
+					linked.setdefault(data["steam32"], []).append(member)
+		else:
+			for steam32 in steam32s:
+				for discord_id in self.steam32_discord_ids(steam32):
+					member = guild.get_member(discord_id)
+					if member is not None:
+						linked.setdefault(steam32, []).append(member)
+		return linked
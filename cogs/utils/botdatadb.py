@@ -0,0 +1,118 @@
+from sqlalchemy import and_, select, func
+from sqlalchemy import MetaData, Table, Column, BigInteger, String, Boolean, Text
+from collections import OrderedDict
+from .dbmigrate import upgrade_tables, create_engine_wal
+import json
+import os
+
+column_types = {
+	int: BigInteger,
+	str: String,
+	bool: Boolean
+}
+
+# makes a table for a type of botdata item, with a typed column for each of its variables
+# anything without a column type (like lists) gets stored as json text
+# a NULL value means the variable hasnt been set, so the default gets used
+def create_table(metadata, item_type):
+	columns = []
+	for key, t in item_type.primary_key_types.items():
+		columns.append(Column(key, column_types[t], primary_key=True, autoincrement=False))
+	for key, t in item_type.variable_types.items():
+		columns.append(Column(key, column_types.get(t, Text), index=key in item_type.indexed, nullable=True))
+	return Table(item_type.list_key, metadata, *columns)
+
+
+# stores botdata in an sqlite database, so it doesnt all have to be loaded into memory
+class SqliteBackend:
+	def __init__(self, path, item_types):
+		self.engine = create_engine_wal(path)
+
+		self.metadata = MetaData()
+		self.tables = {}
+		self.json_columns = {}
+		for item_type in item_types:
+			self.tables[item_type.list_key] = create_table(self.metadata, item_type)
+			self.json_columns[item_type.list_key] = [ key for key, t in item_type.variable_types.items() if t not in column_types ]
+		self.metadata.create_all(self.engine)
+		upgrade_tables(self.engine, self.metadata)
+
+	def where_key(self, table, key):
+		return and_(*(column == value for column, value in zip(table.primary_key.columns, key)))
+
+	def to_dict(self, list_key, row):
+		data = OrderedDict()
+		for column, value in row.items():
+			if value is not None:
+				if column in self.json_columns[list_key]:
+					value = json.loads(value)
+				data[column] = value
+		return data
+
+	def to_row(self, list_key, data):
+		row = {}
+		for column in self.tables[list_key].columns:
+			value = data.get(column.name)
+			if value is not None and column.name in self.json_columns[list_key]:
+				value = json.dumps(value)
+			row[column.name] = value
+		return row
+
+	# gets the data for the item with the given primary key, or None if it hasnt been set
+	def get(self, list_key, key):
+		table = self.tables[list_key]
+		row = self.engine.execute(table.select().where(self.where_key(table, key))).first()
+		if row is None:
+			return None
+		return self.to_dict(list_key, row)
+
+	def set(self, list_key, key, data):
+		table = self.tables[list_key]
+		row = self.to_row(list_key, data)
+		with self.engine.begin() as connection:
+			result = connection.execute(table.update().where(self.where_key(table, key)).values(**row))
+			if result.rowcount == 0:
+				connection.execute(table.insert().values(**row))
+
+	def items(self, list_key):
+		for row in self.engine.execute(self.tables[list_key].select()).fetchall():
+			yield self.to_dict(list_key, row)
+
+	# gets the primary keys of the items where the indexed variable has the given value
+	def find(self, list_key, column, value):
+		table = self.tables[list_key]
+		query = select(list(table.primary_key.columns)).where(table.columns[column] == value)
+		return [ tuple(row) for row in self.engine.execute(query) ]
+
+	def count(self, list_key, key=None):
+		table = self.tables[list_key]
+		query = select([func.count()]).select_from(table)
+		if key is not None:
+			query = query.where(table.columns[key] != None)
+		return self.engine.execute(query).scalar()
+
+	def is_empty(self):
+		for table in self.tables.values():
+			if self.engine.execute(table.select().limit(1)).first() is not None:
+				return False
+		return True
+
+	# copies everything over from botdata.json if this is a new database
+	def import_json(self, json_path):
+		if not os.path.exists(json_path) or not self.is_empty():
+			return
+		print(f"Importing {json_path} into the botdata database")
+		with open(json_path, "r") as f:
+			json_data = json.load(f)
+		with self.engine.begin() as connection:
+			for list_key, table in self.tables.items():
+				rows = OrderedDict()
+				for data in json_data.get(list_key, []):
+					key = tuple(data.get(column.name) for column in table.primary_key.columns)
+					rows.setdefault(key, self.to_row(list_key, data))
+				if rows:
+					connection.execute(table.insert(), list(rows.values()))
+				print(f"Imported {len(rows)} {list_key} items")
+
+	def close(self):
+		self.engine.dispose()
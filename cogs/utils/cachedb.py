@@ -0,0 +1,45 @@
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import Column, Integer, String, Float
+from sqlalchemy.orm import sessionmaker
+from .dbmigrate import upgrade_tables, create_engine_wal
+
+Base = declarative_base()
+
+class CacheEntry(Base):
+	__tablename__ = 'entries'
+
+	id = Column(Integer, primary_key=True)
+	uri = Column(String, unique=True, index=True)
+	filename = Column(String)
+	size = Column(Integer)
+	blob = Column(String, index=True)
+	accessed = Column(Float, index=True)
+	expires = Column(Float)
+	etag = Column(String)
+	last_modified = Column(String)
+
+	def __repr__(self):
+		return f"{self.uri}: {self.filename}"
+
+# a file in the cache, named by the hash of its contents so that identical files are only stored once
+class Blob(Base):
+	__tablename__ = 'blobs'
+
+	hash = Column(String, primary_key=True)
+	filename = Column(String)
+	size = Column(Integer) # the size on disk
+	raw_size = Column(Integer) # the size before compression
+	refs = Column(Integer)
+
+	def __repr__(self):
+		return f"{self.hash}: {self.refs} refs"
+
+
+# returns an open session for the cache index
+def create_session(cachedb_path):
+	engine = create_engine_wal(cachedb_path)
+
+	Base.metadata.create_all(engine)
+	upgrade_tables(engine, Base.metadata)
+	Session = sessionmaker(bind=engine)
+	return Session()
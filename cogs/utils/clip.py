@@ -9,16 +9,162 @@ import os
 import random
 import html
 import requests
+import subprocess
+import shutil
+import tempfile
+import asyncio
+import async_timeout
+from concurrent.futures import ThreadPoolExecutor
+
+# an engine that can convert text to speech
+# the engines are tried in the order they are listed here when the one a guild picked fails
+class TtsEngine(object):
+	@classmethod
+	@abstractmethod
+	def name(cls):
+		pass
+
+	@classmethod
+	@abstractmethod
+	def save(cls, filename, text, lang):
+		pass
+
+	@classmethod
+	def available(cls):
+		return True
+
+	# the engines that are installed on this machine, by name
+	@classmethod
+	def engines_dict(cls):
+		return { engine.name(): engine for engine in cls.__subclasses__() if engine.available() }
+
+	# gets the engine with the given name, then any others that could be used if it fails
+	@classmethod
+	def with_fallbacks(cls, name):
+		engines = [ engine for engine in cls.__subclasses__() if engine.available() ]
+		engines.sort(key=lambda engine: engine.name() != name)
+		return engines
+
+class GttsEngine(TtsEngine):
+	@classmethod
+	def name(cls):
+		return "gtts"
+
+	@classmethod
+	def save(cls, filename, text, lang):
+		try:
+			tts = gTTS(text=text, lang=lang)
+			tts.save(filename)
+		except AttributeError:
+			raise UserError("Whoops. Looks like gtts is broken right now.")
+		except (RecursionError, requests.exceptions.HTTPError):
+			raise UserError("There was a problem converting that via gtts")
+
+class Pico2WaveEngine(TtsEngine):
+	langs = [ "en-GB", "en-US", "de-DE", "es-ES", "fr-FR", "it-IT" ]
 
-def tts_save(filename, text, lang):
-	# run_command(["pico2wave", "--wave", filename, "-l", "en-GB", text])
+	@classmethod
+	def name(cls):
+		return "pico2wave"
+
+	@classmethod
+	def available(cls):
+		return shutil.which("pico2wave") is not None
+
+	# picks the closest pico2wave language to the gtts one
+	@classmethod
+	def get_lang(cls, lang):
+		lang = lang.lower()
+		for pico_lang in cls.langs:
+			if pico_lang.lower() == lang:
+				return pico_lang
+		for pico_lang in cls.langs:
+			if pico_lang.lower().startswith(lang.split("-")[0] + "-"):
+				return pico_lang
+		raise UserError(f"pico2wave can't speak '{lang}'")
+
+	@classmethod
+	def save(cls, filename, text, lang):
+		try:
+			run_command(["pico2wave", "--wave", filename, "-l", cls.get_lang(lang), "--", text]) # the -- is so text starting with - isnt read as an option
+		except subprocess.CalledProcessError:
+			raise UserError("There was a problem converting that via pico2wave")
+
+class EspeakEngine(TtsEngine):
+	@classmethod
+	def name(cls):
+		return "espeak-ng"
+
+	@classmethod
+	def available(cls):
+		return shutil.which("espeak-ng") is not None
+
+	@classmethod
+	def save(cls, filename, text, lang):
+		lang = lang.lower()
+		if lang not in [ "en-us", "en-gb" ]:
+			lang = lang.split("-")[0]
+		try:
+			run_command(["espeak-ng", "-w", filename, "-v", lang, "--", text])
+		except subprocess.CalledProcessError:
+			raise UserError("There was a problem converting that via espeak-ng")
+
+# gtts clips were cached before there were other engines, so they keep the old uri
+def get_tts_uri(text, lang, engine):
+	if engine == "gtts":
+		return f"clip_tts_{lang}:{text}"
+	return f"clip_tts_{engine}_{lang}:{text}"
+
+# the engines block while they work, so they get run on these threads instead of the event loop
+tts_executor = ThreadPoolExecutor(max_workers=settings.tts_workers)
+tts_inflight = {}
+
+# gets the file for the tts clip, making it if it isnt in the cache yet
+# if the same clip is already being made, this waits for that one instead of making it again
+async def get_tts_file(text, lang, engine="gtts"):
+	uri = get_tts_uri(text, lang, engine)
+	filename = httpgetter.cache.get_filename(uri)
+	if filename:
+		return filename
+	if uri not in tts_inflight:
+		task = asyncio.ensure_future(create_tts_file(text, lang, engine))
+		task.add_done_callback(lambda t: tts_inflight.pop(uri, None))
+		tts_inflight[uri] = task
+	return await asyncio.shield(tts_inflight[uri])
+
+# tries each engine until one works, starting with the one that was asked for
+# clips made by a fallback engine are cached under that engine's uri, so the asked for engine gets tried again next time
+async def create_tts_file(text, lang, engine):
+	error = None
+	for tts_engine in TtsEngine.with_fallbacks(engine):
+		uri = get_tts_uri(text, lang, tts_engine.name())
+		filename = httpgetter.cache.get_filename(uri)
+		if filename:
+			return filename
+		try:
+			return await synthesize(uri, text, lang, tts_engine)
+		except Exception as e:
+			print(f"tts engine {tts_engine.name()} failed: {e}")
+			error = error or e
+	raise error
+
+async def synthesize(uri, text, lang, tts_engine):
+	fd, temp_filename = tempfile.mkstemp(suffix=".wav")
+	os.close(fd)
+	future = asyncio.get_event_loop().run_in_executor(tts_executor, tts_engine.save, temp_filename, text, lang)
 	try:
-		tts = gTTS(text=text, lang=lang)
-		tts.save(filename)
-	except AttributeError:
-		raise UserError("Whoops. Looks like gtts is broken right now.")
-	except (RecursionError, requests.exceptions.HTTPError):
-		raise UserError("There was a problem converting that via gtts")
+		async with async_timeout.timeout(settings.tts_timeout):
+			await asyncio.shield(future)
+	except asyncio.TimeoutError:
+		# the thread can't be stopped, so clean up after it when it finishes
+		future.add_done_callback(lambda f: os.remove(temp_filename))
+		raise UserError("Converting that to speech is taking too long. Try again in a bit")
+	except:
+		os.remove(temp_filename)
+		raise
+	filename = await httpgetter.cache.new(uri, "wav")
+	shutil.move(temp_filename, filename)
+	return await httpgetter.cache.commit(uri)
 
 class ClipNotFound(UserError):
 	def __init__(self, cliptype, clipname):
@@ -113,16 +259,9 @@ class TtsClip(Clip):
 	async def init(self, text, bot, ctx):
 		data = botdata.guildinfo(ctx)
 		ttslang = "en-au" if not data else data.ttslang
-		uri = f"clip_tts_{ttslang}:{text}"
+		ttsengine = "gtts" if not data else data.ttsengine
 
-		filename = httpgetter.cache.get_filename(uri)
-		if not filename:
-			filename = await httpgetter.cache.new(uri, "wav")
-			try:
-				tts_save(filename, text, ttslang)
-			except:
-				await httpgetter.cache.remove(uri)
-				raise
+		filename = await get_tts_file(text, ttslang, ttsengine)
 		return await Clip.init(self, text, filename, text)
 
 	@classmethod
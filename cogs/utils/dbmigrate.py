@@ -0,0 +1,32 @@
+from sqlalchemy import inspect, create_engine, event
+
+# creates an engine for the sqlite database at the given path, in WAL mode
+# WAL lets readers keep going while something is writing, and survives a crash mid-write without rewriting everything
+def create_engine_wal(path, **kwargs):
+	engine = create_engine('sqlite:///' + path, **kwargs)
+
+	@event.listens_for(engine, "connect")
+	def on_connect(dbapi_connection, connection_record):
+		cursor = dbapi_connection.cursor()
+		cursor.execute("PRAGMA journal_mode=WAL")
+		cursor.execute("PRAGMA synchronous=NORMAL")
+		cursor.close()
+
+	return engine
+
+# sqlalchemy's create_all only creates tables that dont exist yet,
+# so this adds any columns and indexes that have been added to existing tables since
+def upgrade_tables(engine, metadata):
+	inspector = inspect(engine)
+	for table in metadata.sorted_tables:
+		columns = [ column["name"] for column in inspector.get_columns(table.name) ]
+		for column in table.columns:
+			if column.name not in columns:
+				print(f"Adding column {column.name} to {table.name}")
+				column_type = column.type.compile(dialect=engine.dialect)
+				engine.execute(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
+		indexes = [ index["name"] for index in inspector.get_indexes(table.name) ]
+		for index in table.indexes:
+			if index.name not in indexes:
+				print(f"Adding index {index.name} to {table.name}")
+				index.create(engine)
@@ -8,6 +8,7 @@ import os
 import numpy
 from PIL import Image, ImageDraw, ImageFont
 from .tabledraw import Table, ImageCell, TextCell, ColorCell
+from .perf import timed
 from io import BytesIO
 from .helpers import run_command, get_pretty_time, read_json, UserError, format_duration_simple
 
@@ -43,6 +44,34 @@ async def get_item_image(item_id):
 	except KeyError:
 		return Image.new('RGBA', (10, 10), (0, 0, 0, 0))
 
+# downloads all of the hero and item images into the cache, so the first ?match after a deploy isnt slow
+# runs a few at a time so it doesnt get in the way of commands
+async def prewarm_images(concurrency=4):
+	urls = []
+	for info in hero_infos.values():
+		urls.extend([ info["image"], info["icon"] ])
+	for info in item_infos.values():
+		urls.append(info["icon"])
+	print(f"prewarming cache with {len(urls)} images")
+
+	semaphore = asyncio.Semaphore(concurrency)
+	done = 0
+	failed = 0
+	async def prewarm(url):
+		nonlocal done, failed
+		async with semaphore:
+			try:
+				await httpgetter.get(url, "filename", cache=True)
+			except Exception as e:
+				failed += 1
+				print(f"failed to prewarm {url}: {e}")
+			done += 1
+			if done % 100 == 0:
+				print(f"prewarmed {done}/{len(urls)} images")
+
+	await asyncio.gather(*map(prewarm, urls))
+	print(f"done prewarming cache ({failed} failed)")
+
 async def get_item_images(player):
 	images = []
 	for i in range(0, 6):
@@ -165,6 +194,7 @@ async def draw_match_table(match):
 			await add_player_row(table, player, is_parsed)
 	return table.render()
 
+@timed("render")
 async def create_match_image(match):
 	table_border = 10
 	table_image = await draw_match_table(match)
@@ -189,6 +219,7 @@ async def create_match_image(match):
 
 	return fp
 
+@timed("render")
 async def combine_image_halves(img_url1, img_url2):
 	img1 = Image.open(await httpgetter.get(img_url1, "bytes", cache=True)).convert("RGBA")
 	img2 = Image.open(await httpgetter.get(img_url2, "bytes", cache=True)).convert("RGBA")
@@ -243,6 +274,7 @@ async def place_icon_on_map(map_image, icon, x, y):
 	return paste_image(map_image, icon, int(x - (icon.width / 2)), int(y - (icon.height / 2)))
 
 
+@timed("render")
 async def create_dota_gif(match, stratz_match, start_time, end_time, ms_per_second=100):
 	uri = f"match_gif:{match['match_id']}:{start_time}:{end_time}:{ms_per_second}"
 
@@ -393,6 +425,7 @@ async def create_dota_gif(match, stratz_match, start_time, end_time, ms_per_seco
 
 	return filename
 
+@timed("render")
 async def create_dota_emoticon(emoticon, url):
 	uri = f"dota_emoticon:{emoticon.name}"
 	filename = httpgetter.cache.get_filename(uri)
@@ -425,6 +458,7 @@ async def create_dota_emoticon(emoticon, url):
 	return filename
 
 
+@timed("render")
 async def dota_rank_icon(rank_tier, leaderboard_rank):
 	if rank_tier is None:
 		rank_tier = 0
@@ -472,6 +506,7 @@ async def dota_rank_icon(rank_tier, leaderboard_rank):
 	return filename
 
 
+@timed("render")
 async def draw_matches_table(matches, game_strings):
 	border_size = 10
 	table = Table(background=background_color)
@@ -517,6 +552,7 @@ async def draw_matches_table(matches, game_strings):
 
 
 # given talents as they are stored in dotabase
+@timed("render")
 async def draw_hero_talents(hero):
 	talents = hero.talents.split("|")
 	talent_rows = [
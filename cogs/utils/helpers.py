@@ -81,8 +81,14 @@ def get_changelog():
 
 def write_json(filename, data):
 	text = json.dumps(data, indent="\t")
-	with open(filename, "w+") as f:
-		f.write(text) # Do it like this so it doesnt break mid-file
+	write_text(filename, text)
+
+# writes to a temp file and then swaps it in, so the file is never left half-written
+def write_text(filename, text):
+	temp_filename = filename + ".tmp"
+	with open(temp_filename, "w+") as f:
+		f.write(text)
+	os.replace(temp_filename, filename)
 
 def read_json(filename):
 	with open(filename) as f:
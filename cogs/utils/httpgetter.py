@@ -1,76 +1,372 @@
 from __main__ import settings
 from .helpers import *
+from . import cachedb
+from .perf import timed
 import re
+import time
+import tempfile
+import hashlib
+import gzip
+import shutil
+import random
+import itertools
+import datetime
 import aiohttp
+import async_timeout
+from sqlalchemy import func
 from io import BytesIO
+from urllib.parse import urlparse
+from email.utils import parsedate_to_datetime
 
-default_cache = { "count": 0, "files": {} }
+chunk_size = 64 * 1024
+
+# how many seconds cached responses from urls matching these patterns stay fresh
+# None means they never expire, which is the default for anything not listed here
+cache_policies = [
+	(r"^https://api\.opendota\.com/api/matches/", None),
+	(r"^https://api\.opendota\.com/api/players/\d+/recentmatches", 60),
+	(r"^https://api\.opendota\.com/api/players/\d+$", 5 * 60)
+]
+
+# gets the number of seconds the url should be cached for, given the cache argument passed to get
+def get_cache_ttl(url, cache):
+	if cache is not True:
+		return cache
+	for pattern, ttl in cache_policies:
+		if re.search(pattern, url):
+			return ttl
+	return None
+
+def hash_file(filename):
+	sha = hashlib.sha256()
+	with open(filename, "rb") as f:
+		for chunk in iter(lambda: f.read(chunk_size), b""):
+			sha.update(chunk)
+	return sha.hexdigest()
+
+def read_bytes(filename):
+	if filename.endswith(".gz"):
+		with gzip.open(filename, "rb") as f:
+			return f.read()
+	with open(filename, "rb") as f:
+		return f.read()
+
+# writes a gzipped copy of the file next to it, and returns the new filename
+def compress_file(filename):
+	compressed_filename = filename + ".gz"
+	with open(filename, "rb") as f_in:
+		with gzip.open(compressed_filename, "wb", compresslevel=6) as f_out:
+			shutil.copyfileobj(f_in, f_out, chunk_size)
+	return compressed_filename
 
 class Cache:
 	def __init__(self, loop):
 		self.loop = loop
 		self.cache_dir = settings.resource("cache/")
-		self.index_file = self.cache_dir + "cache_index.json"
-		self.cache = {}
+		self.index_file = self.cache_dir + "cache_index.db"
+		self.max_size = settings.cache_max_size
+		self.max_entries = settings.cache_max_entries
 		self.lock = asyncio.Lock(loop=self.loop)
-		if os.path.isfile(self.index_file):
-			self.cache = read_json(self.index_file)
-		for key in default_cache:
-			if key not in self.cache:
-				self.cache[key] = default_cache[key]
-		self.save_cache()
-
-	@property
-	def files(self):
-	    return self.cache["files"]
-
-	def save_cache(self):
 		if not os.path.exists(self.cache_dir):
 			os.makedirs(self.cache_dir)
-		write_json(self.index_file, self.cache)
+		self.session = cachedb.create_session(self.index_file)
+		self.accessed = {} # access times that havent been written to the index yet
+		self.unsized = OrderedDict() # uris whose files were written by someone other than save(), as uri: None
+		self.total_size = None
+		self.total_entries = None
+		self.hot = OrderedDict() # the in-memory tier, as uri: bytes
+		self.hot_size = 0
+		self.hot_max_size = settings.cache_memory_size
+		self.hot_max_item_size = 256 * 1024
+		self.import_json_index(self.cache_dir + "cache_index.json")
+
+	# imports the entries from the old whole-file json index, if there is one
+	def import_json_index(self, filename):
+		if not os.path.isfile(filename):
+			return
+		print("Importing cache_index.json into the cache index db")
+		data = read_json(filename)
+		rows = []
+		for uri, entry in data.get("files", {}).items():
+			if isinstance(entry, str):
+				entry = { "file": entry, "size": None, "accessed": 0 }
+			# older entries dont have a size, so get it now instead of leaving them all for flush_index
+			size = entry["size"]
+			if size is None:
+				if not os.path.isfile(self.cache_dir + entry["file"]):
+					continue
+				size = os.path.getsize(self.cache_dir + entry["file"])
+			match = re.match(r"^(\d+)", entry["file"])
+			rows.append({
+				"id": int(match.group(1)) if match else None,
+				"uri": uri,
+				"filename": entry["file"],
+				"size": size,
+				"accessed": entry["accessed"]
+			})
+		# one insert for the lot, as there can be hundreds of thousands of them
+		if rows:
+			self.session.execute(cachedb.CacheEntry.__table__.insert().prefix_with("OR REPLACE"), rows)
+		self.session.commit()
+		os.remove(filename)
+
+	def get_entry(self, uri):
+		return self.session.query(cachedb.CacheEntry).filter_by(uri=uri).first()
 
 	# Returns the filename of the cached url if it exists, otherwise None
 	def get_filename(self, uri):
-		if uri not in self.files:
+		entry = self.get_entry(uri)
+		if entry is None or entry.filename is None:
 			return None
-		filename = self.cache_dir + self.files[uri]
+		filename = self.cache_dir + entry.filename
 		if not os.path.isfile(filename):
 			return None
+		self.accessed[uri] = time.time()
 		return filename
 
+	# Whether the uri is cached and hasn't expired yet
+	def is_fresh(self, uri):
+		entry = self.get_entry(uri)
+		if entry is None or entry.filename is None or not os.path.isfile(self.cache_dir + entry.filename):
+			return False
+		return entry.expires is None or entry.expires > time.time()
+
+	# whether the cached version of the uri expired less than max_stale seconds ago, so its still ok to show while we refresh it
+	def is_usable_stale(self, uri, max_stale):
+		entry = self.get_entry(uri)
+		if entry is None or entry.filename is None or not os.path.isfile(self.cache_dir + entry.filename):
+			return False
+		return entry.expires is None or entry.expires + max_stale > time.time()
+
 	# Returns the file if it exists, otherwise None
-	def get(self, uri, return_type):
+	async def get(self, uri, return_type):
 		filename = self.get_filename(uri)
 		if not filename:
 			return None
+		if return_type == "filename":
+			if filename.endswith(".gz"):
+				raise ValueError(f"The cached file for '{uri}' is compressed, so get it as json, text, or bytes instead")
+			return filename
+		if return_type not in [ "json", "text", "bytes" ]:
+			raise ValueError(f"Invalid return type '{return_type}'")
+
+		data = self.hot.get(uri)
+		if data is None:
+			data = await self.loop.run_in_executor(None, read_bytes, filename)
+			self.add_hot(uri, data)
+		else:
+			self.hot.move_to_end(uri)
+
 		if return_type == "json":
-			return read_json(filename)
+			return json.loads(data.decode("utf-8"), object_pairs_hook=OrderedDict)
 		elif return_type == "text":
-			with open(filename, "r") as f:
-				return f.read()
+			return data.decode("utf-8")
 		elif return_type == "bytes":
-			with open(filename, "rb") as f:
-				return BytesIO(f.read())
-		elif return_type == "filename":
-			return filename
-		else:
-			raise ValueError(f"Invalid return type '{return_type}'")
+			return BytesIO(data)
+
+	# keeps small files in memory so frequently used things like hero icons dont hit the disk
+	def add_hot(self, uri, data):
+		if len(data) > self.hot_max_item_size:
+			return
+		self.hot[uri] = data
+		self.hot_size += len(data)
+		while self.hot_size > self.hot_max_size:
+			uri, data = self.hot.popitem(last=False)
+			self.hot_size -= len(data)
+
+	def remove_hot(self, uri):
+		data = self.hot.pop(uri, None)
+		if data is not None:
+			self.hot_size -= len(data)
 
 	#creates a new entry in the cache and returns the filename of the new entry
+	#call commit() after writing to the file to move it into the deduplicated store
 	async def new(self, uri, extension=None):
 		with (await self.lock):
-			if uri in self.files:
-				return self.cache_dir + self.files[uri]
-			filename = f"{self.cache['count']:0>4}"
-			if extension:
-				filename = f"{filename}.{extension}"
-			self.files[uri] = filename
-			self.cache["count"] += 1
-			self.save_cache()
+			try:
+				entry = self.get_entry(uri)
+				if entry and not entry.blob and entry.filename:
+					self.remove_hot(uri) # the caller is about to overwrite it
+					return self.cache_dir + entry.filename
+				entry = self.get_or_create_entry(uri)
+				self.detach(entry) # the caller is about to write a new version, so it can't share the old one
+				filename = f"{entry.id:0>4}"
+				if extension:
+					filename = f"{filename}.{extension}"
+				entry.filename = filename
+				self.unsized[uri] = None
+				self.evict(keep=uri)
+				self.session.commit()
+			except Exception:
+				self.rollback()
+				raise
 		return self.cache_dir + filename
 
+	# throws away the changes to the index when something fails partway through, so whatever commits next doesnt save them
+	# the totals get reloaded from the index, as they may have been changed along with it
+	# must be called while holding the lock
+	def rollback(self):
+		self.session.rollback()
+		self.total_size = None
+		self.total_entries = None
+
+	# must be called while holding the lock
+	def get_or_create_entry(self, uri):
+		entry = self.get_entry(uri)
+		if entry is None:
+			self.load_totals()
+			entry = cachedb.CacheEntry(uri=uri, accessed=time.time())
+			self.session.add(entry)
+			self.session.flush() # gets us an id to name the file with
+			self.total_entries += 1
+		return entry
 
-	async def save(self, url, return_type, response):
+	# moves a file that was written to the filename from new() into the deduplicated store
+	# returns the new filename of the entry
+	async def commit(self, uri):
+		filename = self.get_filename(uri)
+		if filename is None:
+			return None
+		digest = await self.loop.run_in_executor(None, hash_file, filename)
+		with (await self.lock):
+			try:
+				entry = self.get_entry(uri)
+				if entry is None or entry.blob or not os.path.isfile(filename):
+					return self.get_filename(uri)
+				extension = os.path.splitext(entry.filename)[1][1:]
+				self.store_blob(entry, filename, digest, os.path.getsize(filename), extension)
+				self.evict(keep=uri)
+				self.session.commit()
+				return self.cache_dir + entry.filename
+			except Exception:
+				self.rollback()
+				raise
+
+	# moves the file into the content-addressed store and points the entry at it
+	# must be called while holding the lock
+	# size is the size of the original file, and stored_size is the size after compression, if it was compressed
+	def store_blob(self, entry, temp_filename, digest, size, extension, stored_size=None):
+		self.load_totals()
+		if entry.blob == digest:
+			os.remove(temp_filename) # we already have this exact file
+			return
+		blob = self.session.query(cachedb.Blob).get(digest)
+		if blob is None:
+			filename = f"{digest}.{extension}" if extension else digest
+			os.replace(temp_filename, self.cache_dir + filename)
+			blob = cachedb.Blob(hash=digest, filename=filename, size=stored_size or size, raw_size=size, refs=0)
+			self.session.add(blob)
+			self.total_size += blob.size
+		elif os.path.isfile(temp_filename):
+			os.remove(temp_filename)
+		self.detach(entry)
+		blob.refs += 1
+		entry.blob = blob.hash
+		entry.filename = blob.filename
+		entry.size = size
+
+	# releases the entry's file, deleting it if nothing else is using it
+	# must be called while holding the lock
+	def detach(self, entry):
+		self.load_totals()
+		filename = None
+		if entry.blob:
+			blob = self.session.query(cachedb.Blob).get(entry.blob)
+			if blob:
+				blob.refs -= 1
+				if blob.refs <= 0:
+					self.total_size -= blob.size
+					filename = self.cache_dir + blob.filename
+					self.session.delete(blob)
+		else:
+			if entry.size is not None:
+				self.total_size -= entry.size
+			if entry.filename:
+				filename = self.cache_dir + entry.filename
+		entry.blob = None
+		entry.filename = None
+		entry.size = None
+		self.unsized.pop(entry.uri, None)
+		self.remove_hot(entry.uri)
+		if filename and os.path.isfile(filename):
+			os.remove(filename)
+
+	# loads the total size and count of the cache from the index
+	# the total size counts each blob once, no matter how many entries point to it
+	def load_totals(self):
+		if self.total_size is not None:
+			return
+		unshared = self.session.query(cachedb.CacheEntry).filter(cachedb.CacheEntry.blob == None)
+		self.total_entries = self.session.query(cachedb.CacheEntry).count()
+		self.total_size = unshared.with_entities(func.sum(cachedb.CacheEntry.size)).scalar() or 0
+		self.total_size += self.session.query(func.sum(cachedb.Blob.size)).scalar() or 0
+		self.unsized.update((uri, None) for (uri,) in unshared.filter(cachedb.CacheEntry.size == None).with_entities(cachedb.CacheEntry.uri))
+
+	def stats(self):
+		self.load_totals()
+		entry_query = self.session.query(cachedb.CacheEntry)
+		blob_query = self.session.query(cachedb.Blob)
+		shared_size = entry_query.filter(cachedb.CacheEntry.blob != None).with_entities(func.sum(cachedb.CacheEntry.size)).scalar() or 0
+		blob_size = blob_query.with_entities(func.sum(cachedb.Blob.size)).scalar() or 0
+		blob_raw_size = blob_query.with_entities(func.sum(func.coalesce(cachedb.Blob.raw_size, cachedb.Blob.size))).scalar() or 0
+		return OrderedDict([
+			("entries", self.total_entries),
+			("blobs", blob_query.count()),
+			("size", self.total_size),
+			("dedup_savings", shared_size - blob_raw_size),
+			("compression_savings", blob_raw_size - blob_size),
+			("memory_size", self.hot_size)
+		])
+
+	# records the size of a file in the cache
+	def set_size(self, entry, size):
+		self.load_totals()
+		if entry.size is not None:
+			self.total_size -= entry.size
+		entry.size = size
+		self.total_size += size
+		self.unsized.pop(entry.uri, None)
+
+	# writes out any pending access times, and the file sizes for up to max_sizes entries
+	# the sizes are done a batch at a time so a big backlog of them doesnt hold up the lock
+	# must be called while holding the lock
+	def flush_index(self, max_sizes=100):
+		uris = list(itertools.islice(self.unsized, max_sizes))
+		if uris:
+			entries = { entry.uri: entry for entry in self.session.query(cachedb.CacheEntry).filter(cachedb.CacheEntry.uri.in_(uris)) }
+			for uri in uris:
+				entry = entries.get(uri)
+				if entry is None or entry.filename is None:
+					self.unsized.pop(uri, None)
+				elif os.path.isfile(self.cache_dir + entry.filename):
+					self.set_size(entry, os.path.getsize(self.cache_dir + entry.filename))
+				else:
+					self.unsized.move_to_end(uri) # not written yet, so give the others a turn
+		for uri, accessed in self.accessed.items():
+			self.session.query(cachedb.CacheEntry).filter_by(uri=uri).update({ "accessed": accessed })
+		self.accessed = {}
+
+	# removes the least recently used entries until the cache fits within its budget
+	# must be called while holding the lock
+	def evict(self, keep=None):
+		self.flush_index()
+		while self.total_size > self.max_size or self.total_entries > self.max_entries:
+			oldest = self.session.query(cachedb.CacheEntry).filter(cachedb.CacheEntry.uri != keep).order_by(cachedb.CacheEntry.accessed).limit(100).all()
+			if not oldest:
+				break
+			for entry in oldest:
+				if self.total_size <= self.max_size and self.total_entries <= self.max_entries:
+					break
+				self.delete_entry(entry)
+
+	# deletes an entry and its file, must be called while holding the lock
+	def delete_entry(self, entry):
+		self.detach(entry)
+		self.total_entries -= 1
+		self.accessed.pop(entry.uri, None)
+		self.session.delete(entry)
+
+	async def save(self, url, return_type, response, ttl=None):
 		extension = None
 		if return_type == "json":
 			extension = "json"
@@ -83,17 +379,176 @@ class Cache:
 		else:
 			raise ValueError(f"Invalid return type '{return_type}'")
 
-		filename = await self.new(url, extension)
-		with open(filename, "wb+") as f:
-			f.write(await response.read())
+		# stream into a temp file first so a partial download never ends up in the cache
+		check_content_length(url, response)
+		handle, temp_filename = tempfile.mkstemp(dir=self.cache_dir, suffix=".part")
+		size = 0
+		sha = hashlib.sha256()
+		try:
+			with os.fdopen(handle, "wb") as f:
+				async for chunk in response.content.iter_chunked(chunk_size):
+					size += len(chunk)
+					if size > settings.http_max_download_size:
+						raise_too_large(url)
+					sha.update(chunk)
+					await self.loop.run_in_executor(None, f.write, chunk)
+
+			# text compresses really well, and match json is most of what we have cached
+			stored_filename = temp_filename
+			stored_size = None
+			if return_type in [ "json", "text" ]:
+				compressed_filename = await self.loop.run_in_executor(None, compress_file, temp_filename)
+				compressed_size = os.path.getsize(compressed_filename)
+				# small responses can come out bigger, so only keep the compressed one if it helped
+				if compressed_size < size:
+					stored_filename = compressed_filename
+					stored_size = compressed_size
+					extension += ".gz"
+				else:
+					os.remove(compressed_filename)
+
+			with (await self.lock):
+				try:
+					entry = self.get_or_create_entry(url)
+					self.store_blob(entry, stored_filename, sha.hexdigest(), size, extension, stored_size)
+					self.set_validators(entry, response, ttl)
+					self.evict(keep=url)
+					self.session.commit()
+				except Exception:
+					self.rollback()
+					raise
+		finally:
+			for filename in [ temp_filename, temp_filename + ".gz" ]:
+				if os.path.isfile(filename):
+					os.remove(filename)
+
+	# stores the expiry time and the etag/last-modified headers we can use to revalidate the entry later
+	def set_validators(self, entry, response, ttl):
+		entry.expires = None if ttl is None else time.time() + ttl
+		entry.etag = response.headers.get("ETag", entry.etag)
+		entry.last_modified = response.headers.get("Last-Modified", entry.last_modified)
+
+	# called when the server told us our cached version is still good
+	async def revalidated(self, uri, response, ttl):
+		with (await self.lock):
+			try:
+				entry = self.get_entry(uri)
+				if entry:
+					self.set_validators(entry, response, ttl)
+					self.session.commit()
+			except Exception:
+				self.rollback()
+				raise
+
+	# gets the headers for a conditional request that revalidates the cached version of the uri
+	def get_conditional_headers(self, uri):
+		headers = {}
+		entry = self.get_entry(uri)
+		if entry is None or not self.get_filename(uri):
+			return headers
+		if entry.etag:
+			headers["If-None-Match"] = entry.etag
+		if entry.last_modified:
+			headers["If-Modified-Since"] = entry.last_modified
+		return headers
 
 
 	async def remove(self, uri):
 		with (await self.lock):
-			filename = self.cache_dir + self.files.pop(uri)
-			self.save_cache()
-			if os.path.isfile(filename):
-				os.remove(filename)
+			try:
+				entry = self.get_entry(uri)
+				if entry is None:
+					raise KeyError(uri)
+				self.delete_entry(entry)
+				self.session.commit()
+			except Exception:
+				self.rollback()
+				raise
+
+# requests per minute and the number that can be sent in a burst, for each host we talk to a lot
+default_rate_limits = {
+	"api.opendota.com": { "rate": 60, "burst": 10 },
+	"api.stratz.com": { "rate": 60, "burst": 10 },
+	"pokeapi.co": { "rate": 100, "burst": 10 }
+}
+
+class RateLimiter:
+	"""A token bucket for a single host
+
+	Requests that are over the limit wait their turn instead of getting rejected"""
+	def __init__(self, loop, rate, burst):
+		self.loop = loop
+		self.rate = rate / 60 # tokens per second
+		self.burst = burst
+		self.tokens = burst
+		self.updated = time.monotonic()
+		self.lock = asyncio.Lock(loop=self.loop)
+		# metrics
+		self.waiting = 0
+		self.requests = 0
+		self.queued = 0
+		self.total_wait = 0
+		self.max_wait = 0
+
+	def refill(self):
+		now = time.monotonic()
+		self.tokens = min(self.burst, self.tokens + ((now - self.updated) * self.rate))
+		self.updated = now
+
+	# waits until a request is allowed to be sent
+	async def acquire(self):
+		start = time.monotonic()
+		self.waiting += 1
+		try:
+			with (await self.lock):
+				self.refill()
+				if self.tokens < 1:
+					await asyncio.sleep((1 - self.tokens) / self.rate)
+					self.refill()
+				self.tokens -= 1
+		finally:
+			self.waiting -= 1
+		waited = time.monotonic() - start
+		self.requests += 1
+		if waited >= 0.01:
+			self.queued += 1
+		self.total_wait += waited
+		self.max_wait = max(self.max_wait, waited)
+
+	def stats(self):
+		return OrderedDict([
+			("rate", f"{int(self.rate * 60)}/min"),
+			("requests", self.requests),
+			("queued", self.queued),
+			("waiting", self.waiting),
+			("avg_wait", round(self.total_wait / self.requests, 2) if self.requests else 0),
+			("max_wait", round(self.max_wait, 2))
+		])
+
+def raise_too_large(url):
+	print(f"download too large: {url}")
+	raise UserError("That file is too big for me to download")
+
+# fails early if the server tells us the response is too big
+def check_content_length(url, response):
+	length = response.headers.get("Content-Length")
+	if length and length.isdigit() and int(length) > settings.http_max_download_size:
+		raise_too_large(url)
+
+# reads the response a chunk at a time, stopping if it gets too big
+async def read_limited(url, response):
+	check_content_length(url, response)
+	chunks = []
+	size = 0
+	async for chunk in response.content.iter_chunked(chunk_size):
+		chunks.append(chunk)
+		size += len(chunk)
+		if size > settings.http_max_download_size:
+			raise_too_large(url)
+	return b"".join(chunks)
+
+async def read_text_limited(url, response):
+	return (await read_limited(url, response)).decode(response.charset or "utf-8")
 
 def raise_error(url, code, errors):
 	print(f"http {code} error on: {url}")
@@ -103,48 +558,225 @@ def raise_error(url, code, errors):
 	else:
 		raise HttpError(template, code)
 
+# whether its worth trying the request again after getting this status code
+def is_retryable(code):
+	return code == 429 or code >= 500
+
+# gets how long to wait before the next retry, or None if we shouldnt bother
+def get_retry_delay(attempt, retry_after=None):
+	if retry_after:
+		try:
+			delay = float(retry_after)
+		except ValueError:
+			try:
+				delay = (parsedate_to_datetime(retry_after) - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+			except (TypeError, ValueError):
+				delay = 0
+		if delay > settings.http_max_retry_delay:
+			return None
+		return max(delay, 0)
+	return random.uniform(0, min(settings.http_max_retry_delay, 0.5 * (2 ** attempt)))
+
+class CircuitBreaker:
+	"""Keeps track of whether a host is down, so we can fail fast instead of waiting on it
+
+	Opens after a number of failures in a row, and lets a single trial request through after reset_time"""
+	def __init__(self, host, threshold=5, reset_time=30):
+		self.host = host
+		self.threshold = threshold
+		self.reset_time = reset_time
+		self.state = "closed"
+		self.failures = 0
+		self.last_code = None
+		self.opened = 0
+		self.trial = False
+		self.rejected = 0
+
+	# raises an error if we shouldnt be sending requests to this host right now
+	# returns True if this request is the trial, in which case the caller has to set trial back to False when its done
+	def check(self, url, errors):
+		if self.state == "open" and time.monotonic() - self.opened >= self.reset_time:
+			self.state = "half-open"
+		if self.state == "half-open" and not self.trial:
+			self.trial = True
+			return True
+		if self.state != "closed":
+			self.rejected += 1
+			if self.last_code:
+				raise_error(url, self.last_code, errors)
+			raise UserError(f"Looks like {self.host} is down right now, so ya gotta wait a sec")
+		return False
+
+	def succeeded(self):
+		self.state = "closed"
+		self.failures = 0
+
+	def failed(self, code=None):
+		self.failures += 1
+		self.last_code = code
+		if self.state == "half-open" or self.failures >= self.threshold:
+			if self.state != "open":
+				print(f"circuit opened for {self.host}")
+			self.state = "open"
+			self.opened = time.monotonic()
+
+	def stats(self):
+		return OrderedDict([
+			("circuit", self.state),
+			("failures", self.failures),
+			("rejected", self.rejected)
+		])
+
 class HttpGetter:
 	def __init__(self):
 		self.loop = asyncio.get_event_loop()
-		self.session = aiohttp.ClientSession(loop=self.loop)
+		connector = aiohttp.TCPConnector(limit_per_host=settings.http_connections_per_host, loop=self.loop)
+		self.session = aiohttp.ClientSession(connector=connector, conn_timeout=settings.http_connect_timeout, loop=self.loop)
 		self.cache = Cache(self.loop)
+		self.inflight = {} # requests currently in progress, as key: task
+		self.awaited = set() # inflight tasks that a caller is waiting on, so their errors will be seen
+		self.rate_limiters = {}
+		rate_limits = dict(default_rate_limits)
+		rate_limits.update(settings.http_rate_limits)
+		for host, limit in rate_limits.items():
+			self.rate_limiters[host] = RateLimiter(self.loop, limit["rate"], limit.get("burst", 1))
+		self.breakers = {}
 
-	async def get(self, url, return_type="json", cache=False, errors={}):
-		if cache and self.cache.get_filename(url):
-			return self.cache.get(url, return_type)
-
-		async with self.session.get(url) as r:
-			if r.status == 200:
-				if cache:
-					await self.cache.save(url, return_type, r)
-					if return_type == "filename":
-						return self.cache.get_filename(url)
-
-				if return_type == "json":
-					return json.loads(await r.text(), object_pairs_hook=OrderedDict)
-				elif return_type == "text":
-					return await r.text()
-				elif return_type == "bytes":
-					return BytesIO(await r.read())
-				else:
-					raise ValueError(f"Invalid return type '{return_type}'")
-			else:
-				raise_error(url, r.status, errors)
+	# waits for the rate limiter of the url's host, if it has one
+	async def rate_limit(self, url):
+		limiter = self.rate_limiters.get(urlparse(url).hostname)
+		if limiter:
+			await limiter.acquire()
 
-	async def post(self, url, return_type="json", errors={}):
-		async with self.session.post(url) as r:
-			if r.status == 200:
-				if return_type == "json":
-					return json.loads(await r.text(), object_pairs_hook=OrderedDict)
-				elif return_type == "text":
-					return await r.text()
-				elif return_type == "bytes":
-					return BytesIO(await r.read())
-				else:
-					raise ValueError(f"Invalid return type '{return_type}'")
-			else:
-				raise_error(url, r.status, errors)
+	def get_breaker(self, url):
+		host = urlparse(url).hostname
+		if host not in self.breakers:
+			self.breakers[host] = CircuitBreaker(host)
+		return self.breakers[host]
+
+	def stats(self):
+		result = OrderedDict()
+		for host in sorted(set(self.rate_limiters) | set(self.breakers)):
+			result[host] = OrderedDict()
+			if host in self.breakers:
+				result[host].update(self.breakers[host].stats())
+			if host in self.rate_limiters:
+				result[host].update(self.rate_limiters[host].stats())
+		return result
 
+	# sends a request, calling handler on the response if it is successful
+	# retries failed requests up to the given number of times, backing off in between
+	async def request(self, method, url, errors, handler, retries=0, headers=None):
+		breaker = self.get_breaker(url)
+		for attempt in range(retries + 1):
+			trial = breaker.check(url, errors)
+			try:
+				await self.rate_limit(url)
+				async with async_timeout.timeout(settings.http_timeout):
+					async with self.session.request(method, url, headers=headers) as r:
+						if r.status == 200 or (r.status == 304 and headers):
+							result = await handler(r)
+							breaker.succeeded()
+							return result
+						if not is_retryable(r.status):
+							breaker.succeeded() # the host is fine, it just didn't like our request
+							raise_error(url, r.status, errors)
+						breaker.failed(r.status)
+						delay = get_retry_delay(attempt, r.headers.get("Retry-After"))
+						if attempt == retries or delay is None:
+							raise_error(url, r.status, errors)
+			except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+				breaker.failed()
+				print(f"http {type(e).__name__} on: {url}")
+				if attempt == retries:
+					raise UserError(f"Looks like {breaker.host} isn't responding right now. Try again in a bit")
+				delay = get_retry_delay(attempt)
+			finally:
+				if trial:
+					breaker.trial = False
+			print(f"retrying in {delay:.1f}s: {url}")
+			await asyncio.sleep(delay)
 
+	# cache can be True to cache the response according to cache_policies, or a number of seconds to cache it for
+	# if stale_while_revalidate is set, an expired cached response is returned right away and refreshed in the background,
+	# as long as it expired less than cache_max_stale_factor times its ttl ago
+	@timed("http")
+	async def get(self, url, return_type="json", cache=False, errors={}, stale_while_revalidate=False):
+		if cache and self.cache.is_fresh(url):
+			return await self.cache.get(url, return_type)
 
+		task = self.start_fetch(url, return_type, cache, errors)
+
+		if cache and stale_while_revalidate and self.cache.is_usable_stale(url, (get_cache_ttl(url, cache) or 0) * settings.cache_max_stale_factor):
+			return await self.cache.get(url, return_type)
+
+		self.awaited.add(task)
+		data = await asyncio.shield(task)
+
+		if cache:
+			return await self.cache.get(url, return_type)
+		if return_type == "json":
+			return json.loads(data, object_pairs_hook=OrderedDict)
+		elif return_type == "text":
+			return data
+		elif return_type == "bytes":
+			return BytesIO(data)
+
+	# starts a request for get, or returns the one already in progress for the same thing
+	# cached requests all end up in the same file, so those are shared regardless of return_type
+	def start_fetch(self, url, return_type, cache, errors):
+		key = (url, "cache") if cache else (url, return_type)
+		if key not in self.inflight:
+			task = asyncio.ensure_future(self.fetch(url, return_type, cache, errors), loop=self.loop)
+			task.add_done_callback(lambda t: self.fetch_done(key, t))
+			self.inflight[key] = task
+		return self.inflight[key]
+
+	def fetch_done(self, key, task):
+		self.inflight.pop(key, None)
+		awaited = task in self.awaited
+		self.awaited.discard(task)
+		if task.cancelled():
+			return
+		# nobody is waiting on a background refresh, so make sure its errors still get seen
+		error = task.exception()
+		if error and not awaited:
+			print(f"http request failed for {key[0]}: {error}")
+
+	# does the actual request for get, returning the raw data so it can be shared between callers
+	async def fetch(self, url, return_type, cache, errors):
+		headers = None
+		if cache:
+			if self.cache.is_fresh(url):
+				return None
+			headers = self.cache.get_conditional_headers(url)
+
+		async def handler(r):
+			if r.status == 304:
+				await self.cache.revalidated(url, r, get_cache_ttl(url, cache))
+				return None
+			if cache:
+				await self.cache.save(url, return_type, r, get_cache_ttl(url, cache))
+				return None
+			if return_type in [ "json", "text" ]:
+				return await read_text_limited(url, r)
+			elif return_type == "bytes":
+				return await read_limited(url, r)
+			else:
+				raise ValueError(f"Invalid return type '{return_type}'")
+
+		return await self.request("GET", url, errors, handler, retries=settings.http_retries, headers=headers)
+
+	@timed("http")
+	async def post(self, url, return_type="json", errors={}):
+		async def handler(r):
+			if return_type == "json":
+				return json.loads(await read_text_limited(url, r), object_pairs_hook=OrderedDict)
+			elif return_type == "text":
+				return await read_text_limited(url, r)
+			elif return_type == "bytes":
+				return BytesIO(await read_limited(url, r))
+			else:
+				raise ValueError(f"Invalid return type '{return_type}'")
 
+		return await self.request("POST", url, errors, handler)
@@ -1,8 +1,15 @@
-from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, Table, DateTime
+from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, Table, DateTime, Date, func
 from sqlalchemy.orm import sessionmaker, relationship
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter, OrderedDict
+from .dbmigrate import upgrade_tables, create_engine_wal
+import traceback
 import datetime
+import json
+import gzip
+import asyncio
+import atexit
 import os
 import re
 
@@ -16,17 +23,46 @@ class Message(Base):
 	server_id = Column(Integer)
 	channel_id = Column(Integer)
 
-	timestamp = Column(DateTime)
+	timestamp = Column(DateTime, index=True)
 	content = Column(String)
 	clean_content = Column(String)
 	author_name = Column(String)
 	mentions = Column(String)
 
-	command = Column(String)
+	command = Column(String, index=True)
+
+	# how the command went, all times are in seconds
+	started = Column(DateTime)
+	finished = Column(DateTime)
+	duration = Column(Float)
+	error = Column(String)
+	http_time = Column(Float)
+	render_time = Column(Float)
 
 	def __repr__(self):
 		return f"{self.author_name}: {self.clean_content}"
 
+# the number of times a command was used on each day, so stats dont have to scan all of the messages
+class CommandCount(Base):
+	__tablename__ = 'command_counts'
+
+	date = Column(Date, primary_key=True)
+	command = Column(String, primary_key=True)
+	count = Column(Integer)
+
+	def __repr__(self):
+		return f"{self.date} {self.command}: {self.count}"
+
+# the number of times a command has been used in total
+class CommandTotal(Base):
+	__tablename__ = 'command_totals'
+
+	command = Column(String, primary_key=True)
+	count = Column(Integer)
+
+	def __repr__(self):
+		return f"{self.command}: {self.count}"
+
 
 def convert_message(ctx):
 	msg = ctx.message
@@ -45,22 +81,230 @@ def convert_message(ctx):
 		message.command = ctx.command.name
 	return message
 
+def create_tables(engine):
+	Base.metadata.create_all(engine)
+	upgrade_tables(engine, Base.metadata)
+
 # returns an open dotabase session
 # if recreate is true, deletes any existing database first
 def create_session(loggingdb_path):
-	engine = create_engine('sqlite:///' + loggingdb_path)
-	Base.metadata.create_all(engine)
+	engine = create_engine_wal(loggingdb_path)
+	create_tables(engine)
 	Session = sessionmaker(bind=engine)
 	return Session()
 
-# to call from mangobyte.py:
-# loggingdb.update_commands_column(loggingdb_session, bot)
-def update_commands_column(session, bot):
-	for message in session.query(Message):
-		match = re.search(r"^\?([^\s]+)(\s|$)", message.content, re.IGNORECASE)
-		if match:
-			cmd = bot.all_commands.get(match.group(1))
-			if cmd:
-				message.command = cmd.name
+# adds the given messages to the command rollups
+# counts is a Counter of (date, command) -> count
+def add_command_counts(session, counts):
+	totals = Counter()
+	for (date, command), count in counts.items():
+		row = session.query(CommandCount).get((date, command))
+		if row:
+			row.count += count
+		else:
+			session.add(CommandCount(date=date, command=command, count=count))
+		totals[command] += count
+	for command, count in totals.items():
+		row = session.query(CommandTotal).get(command)
+		if row:
+			row.count += count
+		else:
+			session.add(CommandTotal(command=command, count=count))
+
+# rebuilds the command rollups from the messages table
+def rebuild_command_counts(session):
+	session.query(CommandCount).delete()
+	session.query(CommandTotal).delete()
+	counts = Counter()
+	query = session.query(func.date(Message.timestamp), Message.command, func.count(Message.id)).filter(Message.command != None).group_by(func.date(Message.timestamp), Message.command)
+	for date, command, count in query:
+		counts[(datetime.datetime.strptime(date, "%Y-%m-%d").date(), command)] = count
+	add_command_counts(session, counts)
+	session.commit()
+
+
+def message_to_dict(message):
+	data = OrderedDict()
+	for column in Message.__table__.columns:
+		value = getattr(message, column.name)
+		if isinstance(value, datetime.datetime):
+			value = value.isoformat()
+		data[column.name] = value
+	return data
+
+# writes the content of a batch of messages from before cutoff out to a gzipped jsonl file for each month in archive_dir,
+# then removes the content from the database, keeping the rest of the row so the command rollups can still be rebuilt
+# messages without a command are skipped, because update_commands_column needs their content to work out what it was
+# returns the id of the last message archived, to pass in as last_id for the next batch, or None if there was nothing left
+def archive_batch(session, archive_dir, cutoff, last_id=0, batch_size=1000):
+	batch = session.query(Message).filter(Message.id > last_id, Message.timestamp < cutoff, Message.content != None, Message.command != None).order_by(Message.id).limit(batch_size).all()
+	if not batch:
+		return None
+	os.makedirs(archive_dir, exist_ok=True)
+	months = OrderedDict()
+	for message in batch:
+		months.setdefault(message.timestamp.strftime("%Y-%m"), []).append(message)
+	for month, messages in months.items():
+		with gzip.open(os.path.join(archive_dir, f"messages-{month}.jsonl.gz"), "at") as f:
+			for message in messages:
+				f.write(json.dumps(message_to_dict(message)) + "\n")
+	for message in batch:
+		message.content = None
+		message.clean_content = None
+		message.mentions = None
+	session.commit()
+	return batch[-1].id
+
+
+# rebuilds the database file so the space freed up by archiving is given back to the os
+# clearing out content leaves the pages partly empty rather than free, so only a full VACUUM can shrink the file
+def vacuum_database(session):
 	session.commit()
-	print("done updating logged commands!")
\ No newline at end of file
+	session.execute("VACUUM")
+	session.execute("PRAGMA wal_checkpoint(TRUNCATE)") # the file only shrinks once the wal has been written back to it
+
+archive_delay = 10 * 60 # seconds after startup to wait before archiving, so it doesn't compete with everything else starting up
+vacuum_interval = 7 * 24 * 60 * 60 # seconds between vacuums, as a vacuum holds up logging until it's done
+
+# logs messages in batches on a background thread, so commands dont have to wait for the database
+# if retention_days is set, old messages get archived into archive_dir once a day
+class MessageLogger:
+	def __init__(self, loggingdb_path, batch_size=100, flush_interval=1, max_buffer=10000, retention_days=None, archive_dir=None):
+		self.loop = asyncio.get_event_loop()
+		self.retention_days = retention_days
+		self.archive_dir = archive_dir
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval
+		self.queue = asyncio.Queue(maxsize=max_buffer)
+		self.batch = []
+		self.dropped = 0
+		self.last_vacuum = None
+		# the session is only ever used from the executor's one thread
+		engine = create_engine_wal(loggingdb_path, connect_args={ "check_same_thread": False })
+		create_tables(engine)
+		self.session = sessionmaker(bind=engine)()
+		if self.session.query(CommandTotal).first() is None and self.session.query(Message).filter(Message.command != None).first() is not None:
+			print("Building command rollups from logged messages")
+			rebuild_command_counts(self.session)
+		self.executor = ThreadPoolExecutor(max_workers=1)
+		self.task = self.loop.create_task(self.run())
+		if self.retention_days is not None:
+			self.archive_task = self.loop.create_task(self.run_archive())
+		atexit.register(self.close)
+
+	# queues a message to be written, dropping it if the buffer is full
+	def log(self, message):
+		try:
+			self.queue.put_nowait(message)
+		except asyncio.QueueFull:
+			self.dropped += 1
+			if self.dropped % 100 == 1:
+				print(f"Message log buffer full, dropped {self.dropped} messages so far")
+
+	async def run(self):
+		while True:
+			self.batch.append(await self.queue.get())
+			deadline = self.loop.time() + self.flush_interval
+			while len(self.batch) < self.batch_size:
+				timeout = deadline - self.loop.time()
+				if timeout <= 0:
+					break
+				try:
+					self.batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+				except asyncio.TimeoutError:
+					break
+			batch, self.batch = self.batch, []
+			await self.loop.run_in_executor(self.executor, self.write, batch)
+
+	async def run_archive(self):
+		await asyncio.sleep(archive_delay)
+		while True:
+			cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=self.retention_days)
+			last_id = 0
+			archived = False
+			# each batch is its own job on the executor, so the writes can get done in between them
+			while True:
+				last_id = await self.loop.run_in_executor(self.executor, self.archive, cutoff, last_id)
+				if last_id is None:
+					break
+				archived = True
+			if archived and (self.last_vacuum is None or self.loop.time() - self.last_vacuum > vacuum_interval):
+				await self.loop.run_in_executor(self.executor, self.vacuum)
+				self.last_vacuum = self.loop.time()
+			await asyncio.sleep(24 * 60 * 60)
+
+	def archive(self, cutoff, last_id):
+		try:
+			return archive_batch(self.session, self.archive_dir, cutoff, last_id)
+		except Exception:
+			self.session.rollback()
+			print("Failed to archive logged messages")
+			traceback.print_exc()
+			return None
+
+	def vacuum(self):
+		try:
+			vacuum_database(self.session)
+		except Exception:
+			self.session.rollback()
+			print("Failed to vacuum loggingdb")
+			traceback.print_exc()
+
+	def write(self, batch):
+		try:
+			self.session.add_all(batch)
+			add_command_counts(self.session, Counter((message.timestamp.date(), message.command) for message in batch if message.command))
+			self.session.commit()
+		except Exception:
+			self.session.rollback()
+			print(f"Failed to log {len(batch)} messages")
+			traceback.print_exc()
+
+	# writes out anything still waiting, called at shutdown
+	def close(self):
+		self.executor.shutdown(wait=True)
+		batch, self.batch = self.batch, []
+		while not self.queue.empty():
+			batch.append(self.queue.get_nowait())
+		if batch:
+			self.write(batch)
+		self.session.close()
+
+# goes back through the logged messages and sets the command for each one that used a command
+# works in batches of messages, committing after each one and saving the last id done to checkpoint_path,
+# so it can be stopped and then resumed where it left off
+# to run from the command line:
+# python mangobyte.py update_commands_column
+def update_commands_column(session, bot, checkpoint_path=None, batch_size=1000):
+	last_id = 0
+	if checkpoint_path and os.path.exists(checkpoint_path):
+		with open(checkpoint_path, "r") as f:
+			last_id = int(f.read())
+		print(f"resuming from message {last_id}")
+	total = session.query(func.count(Message.id)).filter(Message.id > last_id).scalar()
+	done = 0
+	while True:
+		batch = session.query(Message.id, Message.content, Message.command).filter(Message.id > last_id).order_by(Message.id).limit(batch_size).all()
+		if not batch:
+			break
+		updates = []
+		for message_id, content, command in batch:
+			match = re.search(r"^\?([^\s]+)(\s|$)", content or "", re.IGNORECASE)
+			if match:
+				cmd = bot.all_commands.get(match.group(1))
+				if cmd and cmd.name != command:
+					updates.append({ "id": message_id, "command": cmd.name })
+		if updates:
+			session.bulk_update_mappings(Message, updates)
+		session.commit()
+		last_id = batch[-1][0]
+		if checkpoint_path:
+			with open(checkpoint_path, "w+") as f:
+				f.write(str(last_id))
+		done += len(batch)
+		print(f"updated {done:,}/{total:,} messages")
+	print("rebuilding command rollups...")
+	rebuild_command_counts(session)
+	if checkpoint_path and os.path.exists(checkpoint_path):
+		os.remove(checkpoint_path)
+	print("done updating logged commands!")
@@ -0,0 +1,89 @@
+import asyncio
+import functools
+import weakref
+import time
+import datetime
+from collections import defaultdict
+
+# the timer for the command that each task is running
+timers = weakref.WeakKeyDictionary()
+
+def current_task():
+	try:
+		if hasattr(asyncio, "current_task"):
+			return asyncio.current_task()
+		return asyncio.Task.current_task()
+	except RuntimeError: # no running event loop
+		return None
+
+# times a command, splitting up the time spent on things like http requests and rendering
+# times are exclusive, so http requests made while rendering only count towards http
+class Timer:
+	def __init__(self):
+		self.started = datetime.datetime.utcnow()
+		self.start = time.perf_counter()
+		self.end = None
+		self.times = defaultdict(float)
+		self.stack = []
+		self.last = self.start
+
+	@property
+	def duration(self):
+		return (self.end or time.perf_counter()) - self.start
+
+	def stop(self):
+		if self.end is None:
+			self.end = time.perf_counter()
+
+	# adds the time since the last switch to whatever we were doing
+	def switch(self):
+		now = time.perf_counter()
+		if self.stack:
+			self.times[self.stack[-1]] += now - self.last
+		self.last = now
+
+	def push(self, category):
+		self.switch()
+		self.stack.append(category)
+
+	def pop(self):
+		self.switch()
+		self.stack.pop()
+
+# starts timing the command being run in the current task
+def start_timer():
+	timer = Timer()
+	task = current_task()
+	if task is not None:
+		timers[task] = timer
+	return timer
+
+# times the code in the with block (or the coroutine it decorates) as the given category, like "http" or "render"
+class timed:
+	def __init__(self, category):
+		self.category = category
+		self.timer = None
+
+	def __enter__(self):
+		task = current_task()
+		self.timer = timers.get(task) if task is not None else None
+		if self.timer:
+			self.timer.push(self.category)
+
+	def __exit__(self, *args):
+		if self.timer:
+			self.timer.pop()
+
+	def __call__(self, func):
+		@functools.wraps(func)
+		async def wrapper(*args, **kwargs):
+			with timed(self.category):
+				return await func(*args, **kwargs)
+		return wrapper
+
+# gets the value that the given percent of the values are below
+def percentile(values, percent):
+	values = sorted(values)
+	if not values:
+		return None
+	return values[min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))]
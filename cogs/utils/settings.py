@@ -48,6 +48,94 @@ class Settings:
 	def reddit(self):
 		return self.json_data.get("reddit", None)
 
+	# the max number of bytes the http cache is allowed to use on disk
+	@property
+	def cache_max_size(self):
+		return self.json_data.get("cache_max_size", 10 * 1024 * 1024 * 1024)
+
+	# the max number of files the http cache is allowed to hold
+	@property
+	def cache_max_entries(self):
+		return self.json_data.get("cache_max_entries", 100000)
+
+	# the max number of bytes of small cached files to keep in memory
+	@property
+	def cache_memory_size(self):
+		return self.json_data.get("cache_memory_size", 64 * 1024 * 1024)
+
+	# the max number of bytes we'll download for a single http request
+	@property
+	def http_max_download_size(self):
+		return self.json_data.get("http_max_download_size", 64 * 1024 * 1024)
+
+	# the max number of simultaneous connections to a single host
+	@property
+	def http_connections_per_host(self):
+		return self.json_data.get("http_connections_per_host", 8)
+
+	# per-host rate limits, like { "api.opendota.com": { "rate": 60, "burst": 10 } }
+	@property
+	def http_rate_limits(self):
+		return self.json_data.get("http_rate_limits", {})
+
+	# seconds before an http request is given up on
+	@property
+	def http_timeout(self):
+		return self.json_data.get("http_timeout", 30)
+
+	@property
+	def http_connect_timeout(self):
+		return self.json_data.get("http_connect_timeout", 10)
+
+	# the number of times to retry a failed http get
+	@property
+	def http_retries(self):
+		return self.json_data.get("http_retries", 3)
+
+	# the longest we'll wait before retrying an http request
+	@property
+	def http_max_retry_delay(self):
+		return self.json_data.get("http_max_retry_delay", 30)
+
+	# how many ttls past expiring a cached response can still be shown while it is being refreshed
+	@property
+	def cache_max_stale_factor(self):
+		return self.json_data.get("cache_max_stale_factor", 12)
+
+	# whether to download all of the hero and item images into the cache at startup
+	@property
+	def cache_prewarm(self):
+		return self.json_data.get("cache_prewarm", False)
+
+	@property
+	def cache_prewarm_concurrency(self):
+		return self.json_data.get("cache_prewarm_concurrency", 4)
+
+	# how many tts clips can be made at the same time
+	@property
+	def tts_workers(self):
+		return self.json_data.get("tts_workers", 4)
+
+	# how many seconds to wait for a tts clip to be made before giving up
+	@property
+	def tts_timeout(self):
+		return self.json_data.get("tts_timeout", 15)
+
+	# whether to make the intro and outro tts for members ahead of time, while mangobyte is in a voice channel with them
+	@property
+	def tts_presynthesis(self):
+		return self.json_data.get("tts_presynthesis", False)
+
+	# how many days to keep the full content of logged messages before moving it to the monthly archives, or None to keep it forever
+	@property
+	def log_retention_days(self):
+		return self.json_data.get("log_retention_days", None)
+
+	# where botdata is stored, either "json" for botdata.json or "sqlite" for botdata.db
+	@property
+	def botdata_backend(self):
+		return self.json_data.get("botdata_backend", "json")
+
 	def resource(self, dir):
 		return os.path.join(self.resourcedir, dir)
 
@@ -4,8 +4,10 @@ from cogs.utils.botdata import BotData
 from cogs.utils.helpers import *
 from cogs.utils.helpformatter import MangoHelpFormatter
 import cogs.utils.loggingdb as loggingdb
+import cogs.utils.perf as perf
 import traceback
 import asyncio
+import sys
 import string
 from discord.ext import commands
 import logging
@@ -13,9 +15,10 @@ import datetime
 
 logging.basicConfig(level=logging.INFO)
 
-botdata = BotData()
 settings = Settings()
+botdata = BotData(settings.botdata_backend)
 loggingdb_session = loggingdb.create_session(settings.resource("loggingdb.db"))
+message_logger = loggingdb.MessageLogger(settings.resource("loggingdb.db"), retention_days=settings.log_retention_days, archive_dir=settings.resource("loggingdb_archive"))
 
 # This have to be done after loading settings
 from cogs.utils.httpgetter import HttpGetter
@@ -71,8 +74,37 @@ async def invalid_command_reporting(ctx):
 	else:
 		return botdata.guildinfo(ctx.message.guild.id).invalidcommands
 
+# starts timing the command. this is done here instead of in on_command because before_invoke runs in the same task as the command,
+# so the time spent on http requests and rendering can be tracked
+@bot.before_invoke
+async def before_command(ctx):
+	ctx.timer = perf.start_timer()
+
+# logs the command along with how long it took and whether it failed
+def log_command(ctx, error=None):
+	msg = loggingdb.convert_message(ctx)
+	timer = getattr(ctx, "timer", None)
+	if timer:
+		timer.stop()
+		msg.started = timer.started
+		msg.finished = timer.started + datetime.timedelta(seconds=timer.duration)
+		msg.duration = timer.duration
+		msg.http_time = timer.times["http"]
+		msg.render_time = timer.times["render"]
+	if error:
+		msg.error = type(getattr(error, "original", error)).__name__
+	message_logger.log(msg)
+	print(msg)
+
+@bot.event
+async def on_command_completion(ctx):
+	log_command(ctx)
+
 @bot.event
 async def on_command_error(ctx, error):
+	if ctx.command is not None:
+		log_command(ctx, error)
+
 	if ctx.message in thinker.messages:
 		await thinker.stop_thinking(ctx.message)
 
@@ -177,6 +209,9 @@ if __name__ == '__main__':
 	bot.load_extension("cogs.dotastats")
 	bot.load_extension("cogs.pokemon")
 	bot.load_extension("cogs.admin")
-	bot.run(settings.token)
+	if len(sys.argv) > 1 and sys.argv[1] == "update_commands_column":
+		loggingdb.update_commands_column(loggingdb_session, bot, settings.resource("loggingdb.checkpoint"))
+	else:
+		bot.run(settings.token)
 
 